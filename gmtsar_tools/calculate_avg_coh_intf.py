@@ -1,76 +1,259 @@
 #!/usr/bin/env python
 import argparse
 from pathlib import Path
-from gmtsar_tools.utils import grep
-import glob
+from gmtsar_tools.utils import get_bperp, Catalog
+import json
 import numpy as np
 import os
 import pdb
-import subprocess
 import pandas as pd
 from datetime import datetime
 from netCDF4 import Dataset as NetCDFFile
+from concurrent.futures import ProcessPoolExecutor
+
+# Sidecar in each intf directory: {'key': mtimes/sizes of corr.grd and PRMs, 'PBase', 'TBase', 'regions': {region key: accumulators}}
+COH_CACHE = '.avgcoh.json'
+# Coherence histogram in [0, 1] used for median, percentiles and fraction above threshold
+HIST_BINS = 1000
+BLOCK_ROWS = 1024
+
+# Mask grids loaded in each worker process: {absolute path: (mtime_ns, size, mask, rows span, cols span)}
+_mask_cache = dict()
 
 
 def main():
     args = get_args()
-    intf_dir = args.intfdir
-    cutrange = args.cutrange
-    x1, x2, y1, y2 = cutrange
-
-    intfs_dir = glob.glob(f'{intf_dir.as_posix()}/*_*')
-    intfs_dir = [Path(x) for x in intfs_dir]
-    
-    dates12, dates1, dates2 = list(), list(), list()
-    corrs, tbases, bperps = list(), list(), list()
-    cwd = os.getcwd()
-    for intf in intfs_dir:
-        os.chdir(os.getcwd() + '/' + intf.as_posix())
-        prms = glob.glob('*PRM')
-        prms.sort(key=lambda x: datetime.strptime(x[14:22], "%Y%m%d").date())
-        if len(prms) !=2:
-            #raise Exception(f'There are not two PRMs in intf: {intf}')
-            print(f'There are not two PRMs in intf: {intf}... continue')
-            os.chdir('../..')
-            continue
-        date1, date2 = intf.name.split("_")
-        dates12.append(f'{date1}_{date2}')
-        nc = NetCDFFile('corr.grd')
-        corrs.append(np.nanmean(nc.variables['z'][y1:y2,x1:x2]))
-        d1 = datetime.strptime(date1, '%Y%j').date()
-        d2 = datetime.strptime(date2, '%Y%j').date()
-        sat_output = subprocess.run(['SAT_baseline', prms[0], prms[1]], capture_output=True, text=True)
-        bperp_grep = subprocess.run(['grep', 'B_perpendicular'], input=sat_output.stdout, capture_output=True, text=True)
-        bperp = float(bperp_grep.stdout.split("=")[-1].strip())
-        bperps.append(bperp)
-        tbases.append((d2-d1).days)
-        dates1.append(date1)
-        dates2.append(date2)
-        os.chdir('../..')
+    intf_dir = args.intfdir.resolve()
+    cutranges = [tuple(x) for x in args.cutrange] if args.cutrange else []
+    masks = [x.resolve() for x in args.masks] if args.masks else []
+    percentiles = args.percentiles
+    threshold = args.threshold
+    workers = args.workers
+
+    if not cutranges and not masks:
+        raise Exception('At least one window (-r) or mask grid (--mask) is needed')
+
+    # Regions: (label, cache key, window, mask path)
+    regions = [('/'.join(str(x) for x in w), 'window:' + '/'.join(str(x) for x in w), w, None) for w in cutranges]
+    for mask in masks:
+        st = os.stat(mask)
+        regions.append((mask.name, f'mask:{mask.as_posix()}:{st.st_mtime_ns}:{st.st_size}', None, mask))
+
+    with Catalog(args.catalog if args.catalog else intf_dir.parent) as catalog:
+        catalog.refresh_intfs(intf_dir)
+        intfs = catalog.intfs(intf_dir)
+
+    tasks = list()
+    for intf in intfs:
+        if intf['nprm'] !=2:
+            print(f'There are not two PRMs in intf: {intf["path"]}... continue')
+        elif 'corr.grd' not in intf['grids']:
+            print(f'corr.grd does not exist in intf: {intf["path"]}... continue')
+        else:
+            tasks.append((Path(intf['path']), [Path(intf['ref_prm']), Path(intf['sec_prm'])]))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(intf_coherence, *zip(*tasks), [regions] * len(tasks))) if tasks else []
+
+    # Tidy table: one row per interferogram and region
+    rows = list()
+    for res in results:
+        for label, key, _, _ in regions:
+            stats = summarize(res['regions'][key], percentiles, threshold)
+            rows.append({'date12': res['date12'], 'date1': res['date1'], 'date2': res['date2'], 'TBase': res['TBase'],
+                         'PBase': res['PBase'], 'region': label, **stats})
+    stats_df = pd.DataFrame(rows, columns=['date12', 'date1', 'date2', 'TBase', 'PBase', 'region']
+                            + list(stat_names(percentiles)))
 
+    # avgCoherence and CohperDay keep mean coherence of first region
+    first = stats_df[stats_df['region'] == regions[0][0]]
     df = pd.DataFrame({
-    'date12': dates12,
-    'date1': dates1,
-    'date2': dates2,
-    'avgCoherence': corrs,
-    'TBase': tbases,
-    'PBase': bperps,
+    'date12': first['date12'],
+    'date1': first['date1'],
+    'date2': first['date2'],
+    'avgCoherence': first['mean'],
+    'TBase': first['TBase'],
+    'PBase': first['PBase'],
     })
 
     # calculate average per day
-    date_coh_avg = df.groupby('date1')['avgCoherence'].mean().to_numpy()
-    date_coh_df = pd.DataFrame({'date': list(set(dates1)), 'avgCoh': date_coh_avg})
+    date_coh_df = df.groupby('date1')['avgCoherence'].mean().reset_index()
+    date_coh_df.columns = ['date', 'avgCoh']
     print(date_coh_df)
-    
+
     df.to_csv('avgCoherence.txt', sep='\t', index=False)
     date_coh_df.to_csv('CohperDay.txt', sep='\t', index=False)
-    
+    stats_df.to_csv('cohStats.txt', sep='\t', index=False, float_format='%.6g')
+
+
+def stat_names(percentiles):
+    yield from ['mean', 'median']
+    yield from (f'p{q:g}' for q in percentiles)
+    yield from ['valid_frac', 'frac_above']
+
+
+def summarize(acc: dict, percentiles, threshold) -> dict:
+    """
+    Statistics from region accumulators. Mean is exact, median and percentiles are interpolated
+    within the histogram bins (resolution 1/HIST_BINS), fraction above threshold is taken at bin edges
+    """
+    count, npix = acc['count'], acc['npix']
+    hist = np.asarray(acc['hist'], dtype=np.int64)
+    cdf = np.cumsum(hist)
+
+    def percentile(q):
+        if not count:
+            return np.nan
+        target = max(q / 100 * count, 1e-9)
+        i = min(int(np.searchsorted(cdf, target)), HIST_BINS - 1)
+        prev = cdf[i - 1] if i else 0
+        frac = (target - prev) / hist[i] if hist[i] else 0.0
+        return (i + frac) / HIST_BINS
+
+    stats = {'mean': acc['sum'] / count if count else np.nan, 'median': percentile(50)}
+    for q in percentiles:
+        stats[f'p{q:g}'] = percentile(q)
+    stats['valid_frac'] = count / npix if npix else np.nan
+    ithr = min(max(int(np.ceil(threshold * HIST_BINS)), 0), HIST_BINS)
+    stats['frac_above'] = hist[ithr:].sum() / count if count else np.nan
+    return stats
+
+
+def _file_key(paths) -> dict:
+    key = dict()
+    for path in paths:
+        st = os.stat(path)
+        key[path.name] = [st.st_mtime_ns, st.st_size]
+    return key
+
+
+def _read_cache(cachefile: Path, key: dict) -> dict:
+    try:
+        with open(cachefile, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return dict()
+    return cache if cache.get('key') == key else dict()
+
+
+def _span(flags):
+    idx = np.flatnonzero(flags)
+    return (int(idx[0]), int(idx[-1]) + 1) if idx.size else (0, 0)
+
+
+def load_mask(maskPath: Path, shape):
+    """
+    Boolean mask (finite and non zero pixels) of mask grid with rows and cols spans of True pixels.
+    Masks are kept per process while mtime and size do not change
+    """
+    maskPath = Path(maskPath).resolve()
+    st = os.stat(maskPath)
+    cached = _mask_cache.get(maskPath.as_posix())
+    if cached is None or cached[0] != st.st_mtime_ns or cached[1] != st.st_size:
+        with NetCDFFile(maskPath.as_posix()) as nc:
+            nc.set_auto_mask(False)
+            z = nc.variables['z'][:]
+        mask = np.isfinite(z) & (z != 0)
+        cached = (st.st_mtime_ns, st.st_size, mask, _span(mask.any(axis=1)), _span(mask.any(axis=0)))
+        _mask_cache[maskPath.as_posix()] = cached
+    if cached[2].shape != tuple(shape):
+        raise Exception(f'Mask: {maskPath} dimensions: {cached[2].shape} do not match corr.grd dimensions: {tuple(shape)}')
+    return cached[2:]
+
+
+def region_accumulators(corrfile: Path, regions, blockrows=BLOCK_ROWS) -> dict:
+    """
+    Reads corr.grd once in blocks of rows covering all regions (window or mask) and accumulates for each one
+    sum, count of valid pixels, number of pixels and histogram. Returns {region key: accumulators}
+    """
+    with NetCDFFile(corrfile.as_posix()) as nc:
+        nc.set_auto_mask(False)
+        z = nc.variables['z']
+        nrows, ncols = z.shape
+
+        # Region pixels as (rows span, cols span, mask or None), windows follow slicing and are clipped to grid
+        spans = dict()
+        for _, key, window, mask in regions:
+            if window is not None:
+                x1, x2, y1, y2 = window
+                rows = (min(max(y1, 0), nrows), min(max(y2, 0), nrows))
+                cols = (min(max(x1, 0), ncols), min(max(x2, 0), ncols))
+                spans[key] = (rows, cols, None)
+            else:
+                maskarr, rows, cols = load_mask(mask, (nrows, ncols))
+                spans[key] = (rows, cols, maskarr)
+
+        acc = {key: {'sum': 0.0, 'count': 0, 'npix': 0, 'hist': np.zeros(HIST_BINS, dtype=np.int64)} for key in spans}
+        active = [x for x in spans.values() if x[0][0] < x[0][1] and x[1][0] < x[1][1]]
+        if active:
+            r0min, r1max = min(x[0][0] for x in active), max(x[0][1] for x in active)
+            c0min, c1max = min(x[1][0] for x in active), max(x[1][1] for x in active)
+            for r0 in range(r0min, r1max, blockrows):
+                r1 = min(r0 + blockrows, r1max)
+                block = z[r0:r1, c0min:c1max]
+                for key, ((y1, y2), (x1, x2), maskarr) in spans.items():
+                    a, b = max(r0, y1), min(r1, y2)
+                    if a >= b or x1 >= x2:
+                        continue
+                    sub = block[a - r0:b - r0, x1 - c0min:x2 - c0min]
+                    if maskarr is not None:
+                        sub = sub[maskarr[a:b, x1:x2]]
+                    vals = sub[np.isfinite(sub)].astype(np.float64)
+                    acc[key]['npix'] += sub.size
+                    acc[key]['count'] += vals.size
+                    acc[key]['sum'] += vals.sum()
+                    acc[key]['hist'] += np.bincount(np.clip((vals * HIST_BINS).astype(np.int64), 0, HIST_BINS - 1),
+                                                    minlength=HIST_BINS)
+
+    return {key: {'sum': float(x['sum']), 'count': int(x['count']), 'npix': int(x['npix']), 'hist': x['hist'].tolist()}
+            for key, x in acc.items()}
+
+
+def intf_coherence(intf: Path, prms, regions) -> dict:
+    """
+    Coherence accumulators of corr.grd for regions, Bperp and Btemp of interferogram directory
+    with reference and secondary PRMs.
+    Results are cached in intf/COH_CACHE while corr.grd and PRMs are unchanged, only regions not cached
+    are computed, all in one pass over corr.grd
+    """
+    corrfile = intf.joinpath('corr.grd')
+
+    date1, date2 = intf.name.split("_")
+    cachefile = intf.joinpath(COH_CACHE)
+    key = _file_key([corrfile] + prms)
+    cache = _read_cache(cachefile, key)
+    updated = False
+
+    if 'PBase' not in cache:
+        d1 = datetime.strptime(date1, '%Y%j').date()
+        d2 = datetime.strptime(date2, '%Y%j').date()
+        cache = {'key': key, 'PBase': get_bperp(prms[0], prms[1]), 'TBase': (d2-d1).days}
+        updated = True
+    cache.setdefault('regions', dict())
+
+    missing = [x for x in regions if x[1] not in cache['regions']]
+    if missing:
+        cache['regions'].update(region_accumulators(corrfile, missing))
+        updated = True
+
+    if updated:
+        try:
+            with open(cachefile, 'w') as f:
+                json.dump(cache, f)
+        except OSError as e:
+            print(f'Coherence cache could not be written: {cachefile}\nException: {e}')
+
+    return {'date12': f'{date1}_{date2}', 'date1': date1, 'date2': date2, 'TBase': cache['TBase'], 'PBase': cache['PBase'],
+            'regions': {x[1]: cache['regions'][x[1]] for x in regions}}
+
 
 def get_args():
-    mess = "calculates average of coherence (corr) given window"
+    mess = "calculates coherence (corr) statistics given windows and/or mask grids"
 
     example = """EXAMPLE:
-       calculate_avg_coh_intf.py -d directory/path -r 300/2000/600/9000
+       calculate_avg_coh_intf.py -d directory/path -r 300 2000 600 9000
+       calculate_avg_coh_intf.py -d directory/path -r 300 2000 600 9000 --workers 8
+       calculate_avg_coh_intf.py -d directory/path -r 300 2000 600 9000 -r 0 500 0 1000 --mask aoi.grd --percentiles 5 95 --threshold 0.4
         """
 
     parser = argparse.ArgumentParser(description=mess, epilog=example,
@@ -78,7 +261,12 @@ def get_args():
 
     # Required arguments
     parser.add_argument('-d', '--intfdir', dest='intfdir', required=True, type=Path, help='Path to intf directory')
-    parser.add_argument('-r', '--range', dest='cutrange', required=True, nargs=4, type=int, help='Cut range: xmin xmax ymin ymax')
+    parser.add_argument('-r', '--range', dest='cutrange', nargs=4, type=int, action='append', help='Cut range: xmin xmax ymin ymax. Repeat for several windows')
+    parser.add_argument('--mask', dest='masks', nargs='+', type=Path, help='Mask grids with same dimensions as corr.grd, finite non zero pixels are used')
+    parser.add_argument('--percentiles', dest='percentiles', nargs='*', type=float, default=[10, 90], help='Percentiles reported. Default: 10 90')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=0.3, help='Coherence threshold for frac_above. Default: 0.3')
+    parser.add_argument('--catalog', dest='catalog', type=Path, default=None, help='Project catalog (SQLite file or directory). Default: parent of intf directory')
+    parser.add_argument('--workers', dest='workers', type=int, default=4, help='Number of interferograms processed in parallel. Default: 4')
 
     return parser.parse_args()
 
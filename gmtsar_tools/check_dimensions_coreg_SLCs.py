@@ -2,8 +2,7 @@
 import argparse
 from pathlib import Path
 import glob
-from gmtsar_tools.utils import grep
-import numpy as np
+from gmtsar_tools.utils import read_prm, check_slc_file
 import pdb
 
 
@@ -42,36 +41,20 @@ def main():
     for slave_stem in [Path(x.removesuffix('.PRM')) for x in PRMfiles]:
         SLCslave = slave_stem.with_suffix('.SLC')
         PRMslave = slave_stem.with_suffix('.PRM')
-        nlines = grep(PRMslave, 'num_lines')
-        rgbins = grep(PRMslave, 'num_rng_bins')
+        prmslave = read_prm(PRMslave)
+        nlines = prmslave.get('num_lines')
+        rgbins = prmslave.get('num_rng_bins')
         print(f'Dimensions of slaves according to PRM file -> nrows {nlines} range {rgbins}')
         if not check_dimensions(SLCslave, masterPRMfile):
             raise Exception(f'Slave: {slave_stem} dimensions do not match')
 
 
 def check_dimensions(slcfile, prmfile):
-    nlines = grep(prmfile, 'num_lines')
-    rgbins = grep(prmfile, 'num_rng_bins')
-
-    if not nlines:
-        raise Exception(f'Error getting nlines: {nlines} from PRM file: {prmfile}')
-    else:
-        nlines = int(nlines)
-
-    if not rgbins:
-        raise Exception(f'Error getting range lines: {rgbins} from PRM file: {prmfile}')
-    else:
-        rgbins = int(rgbins)
-
-    try:
-        slc_data = np.fromfile(slcfile, dtype=np.int16)
-        slc_data = slc_data.astype(np.float32).view(np.complex64)
-        slc_data = slc_data.reshape((nlines,rgbins))
-    except Exception as e:
-        raise Exception(f'Something wrong reshaping SLC: {slcfile}\nnrows: {nlines} range: {rgbins} SLC shape: {slc_data.shape}\nException: {e}')
+    report = check_slc_file(slcfile, prmfile)
+    if not report['ok']:
+        raise Exception(f'Something wrong with SLC: {slcfile}\nnrows: {report["nlines"]} range: {report["rgbins"]}\n{report["message"]}')
     else:
-        print(f'SLC shape: {slc_data.shape} matches nrows {nlines} and range bins {rgbins}\n')
-        del slc_data
+        print(f'SLC size: {report["actual_bytes"]} bytes matches nrows {report["nlines"]} and range bins {report["rgbins"]}\n')
         return True
 
 
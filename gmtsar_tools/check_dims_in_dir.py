@@ -1,69 +1,47 @@
 #!/usr/bin/env python
 import argparse
 from pathlib import Path
-import glob
-from gmtsar_tools.utils import grep
-import numpy as np
+from gmtsar_tools.utils import check_slc_dir, write_report
 import pdb
 
 
 def main():
     args = get_args()
     directory = args.dir
+    workers = args.workers
+    sample = args.sample
+    reportfile = args.report
 
-    SLCfiles = glob.glob(f'{directory.as_posix()}/*.SLC')
-
-    if len(SLCfiles) == 0:
+    reports = check_slc_dir(directory, sample=sample, workers=workers)
+    if len(reports) == 0:
         raise Exception(f'No SLC files found in directory: {directory}')
-    
-    count_ok = 0
-    count_bad = 0
-    slcfiles_bad = list()
-    for slcfile in sorted(SLCfiles):
-        prmfile = Path(slcfile).with_suffix('.PRM')
-        
-        if not prmfile.exists():
-            print(f'PRM file for slc: {slcfile} does not exist\n')
 
-        nlines = grep(prmfile, 'num_lines')
-        rgbins = grep(prmfile, 'num_rng_bins')
-
-        if not nlines:
-            raise Exception(f'Error getting nlines: {nlines} from PRM file: {prmfile}')
+    slcfiles_bad = list()
+    for report in reports:
+        if report['ok']:
+            print(f'SLC size matches nrows {report["nlines"]} and range bins {report["rgbins"]}\nFile:{report["slc"]}\n')
         else:
-            nlines = int(nlines)
+            print(f'Something wrong with SLC: {report["slc"]}\n{report["message"]}\n')
+            slcfiles_bad.append(report['slc'])
 
-        if not rgbins:
-            raise Exception(f'Error getting range lines: {rgbins} from PRM file: {prmfile}')
-        else:
-            rgbins = int(rgbins)
-        
-        try:
-            slc_data = np.fromfile(slcfile, dtype=np.int16)
-            slc_data = slc_data.astype(np.float32).view(np.complex64)
-            slc_data = slc_data.reshape((nlines,rgbins))
-        except Exception as e:
-            print(f'Something wrong reshaping SLC: {slcfile}\nnrows: {nlines} range: {rgbins} SLC shape: {slc_data.shape}\nException: {e}\n')
-            count_bad += 1
-            slcfiles_bad.append(slcfile)
-            del slc_data
-            continue
-        else:
-            count_ok += 1
-            print(f'SLC shape: {slc_data.shape} matches nrows {nlines} and range bins {rgbins}\nFile:{slcfile}\n')
-            del slc_data
-    
-    print(f'SUMMARY: Total SLCs in folder: {len(SLCfiles)}. Num of SLCs with correct sizes: {count_ok}. Num of SLCs with incorrect sizes: {count_bad}')
+    count_bad = len(slcfiles_bad)
+    count_ok = len(reports) - count_bad
+    print(f'SUMMARY: Total SLCs in folder: {len(reports)}. Num of SLCs with correct sizes: {count_ok}. Num of SLCs with incorrect sizes: {count_bad}')
     if count_bad > 0:
         bad_slcfiles_str = '\n'.join([str(x) for x in slcfiles_bad])
         print(f"SLC files with not matching sizes with PRMs: \n{bad_slcfiles_str}")
 
+    if reportfile:
+        write_report([x for x in reports if not x['ok']], reportfile)
+        print(f'Report of mismatches written to: {reportfile}')
+
 
 def get_args():
     mess = "checks dimensions of SLC based on PRM file in a directory. It needs PRM and SLC files"
 
     example = """EXAMPLE:
-       check_dims_in_dir.py -p path/to/project 
+       check_dims_in_dir.py -d path/to/directory
+       check_dims_in_dir.py -d path/to/directory --workers 16 --sample 8 --report mismatches.json
         """
 
     parser = argparse.ArgumentParser(description=mess, epilog=example,
@@ -71,9 +49,11 @@ def get_args():
 
     # Required arguments
     parser.add_argument('-d', '--dir', dest='dir', required=True, type=Path, help='Path to directory')
+    parser.add_argument('--workers', dest='workers', type=int, default=8, help='Number of files checked in parallel. Default: 8')
+    parser.add_argument('--sample', dest='sample', type=int, default=0, help='Number of row blocks read per SLC to spot-check data. Default: 0 (size check only)')
+    parser.add_argument('--report', dest='report', type=Path, default=None, help='Write mismatches to a .json or .csv report')
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     main()
-
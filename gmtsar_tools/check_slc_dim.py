@@ -1,8 +1,7 @@
 #!/usr/bin/env python
 import argparse
 from pathlib import Path
-from gmtsar_tools.utils import grep
-import numpy as np
+from gmtsar_tools.utils import check_slc_file
 import pdb
 
 
@@ -10,30 +9,13 @@ def main():
     args = get_args()
     slcfile = args.slcfile
     prmfile = args.prmfile
+    sample = args.sample
 
-    nlines = grep(prmfile, 'num_lines')
-    rgbins = grep(prmfile, 'num_rng_bins')
-
-    if not nlines:
-        raise Exception(f'Error getting nlines: {nlines} from PRM file: {prmfile}')
-    else:
-        nlines = int(nlines)
-
-    if not rgbins:
-        raise Exception(f'Error getting range lines: {rgbins} from PRM file: {prmfile}')
+    report = check_slc_file(slcfile, prmfile, sample=sample)
+    if not report['ok']:
+        raise Exception(f'Something wrong with SLC: {slcfile}\nnrows: {report["nlines"]} range: {report["rgbins"]}\n{report["message"]}')
     else:
-        rgbins = int(rgbins)
-
-    try:
-        slc_data = np.fromfile(slcfile, dtype=np.int16)
-        slc_data = slc_data.astype(np.float32).view(np.complex64)
-        slc_data = slc_data.reshape((nlines,rgbins))
-    except Exception as e:
-        del slc_data
-        raise Exception(f'Something wrong reshaping SLC: {slcfile}\nnrows: {nlines} range: {rgbins} SLC shape: {slc_data.shape}\nException: {e}')
-    else:
-        print(f'SLC shape: {slc_data.shape} matches nrows {nlines} and range bins {rgbins}\n')
-        del slc_data
+        print(f'SLC size: {report["actual_bytes"]} bytes matches nrows {report["nlines"]} and range bins {report["rgbins"]}\n')
         return True
 
 
@@ -50,10 +32,10 @@ def get_args():
     # Required arguments
     parser.add_argument('-s', '--slcfile', dest='slcfile', required=True, type=Path, help='Path to SLC file - no symlink')
     parser.add_argument('-p', '--prmfile', dest='prmfile', required=True, type=Path, help='Path to PRM file')
+    parser.add_argument('--sample', dest='sample', type=int, default=0, help='Number of row blocks read to spot-check data. Default: 0 (size check only)')
 
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     main()
-
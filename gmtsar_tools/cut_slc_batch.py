@@ -1,26 +1,37 @@
 #!/usr/bin/env python
 import argparse
 from pathlib import Path
-import glob
-from gmtsar_tools.utils import grep, run_command
-import os
+import shutil
+import subprocess
+import time
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from gmtsar_tools.utils import crop_slc
 import pdb
 
 suffix = "_CUT"
 
 def main():
     args = get_args()
-    directory = args.directory
-    savedir = args.savedir
-    cutrange = args.cutrange
+    directory = args.directory.resolve()
+    savedir = args.savedir.resolve()
+    cutranges = args.cutrange
+    jobs = args.jobs
+    nativeflag = args.nativeflag
+
+    if savedir == directory:
+        raise Exception(f'We are not saving cut files in same directory')
 
     if not savedir.exists():
         savedir.mkdir()
 
-    # Go to SLC directory
-    os.chdir(directory)
-    current_cwd = Path().cwd()
-    prmfiles = [Path(prmf) for prmf in glob.glob('*PRM')]
+    # One AOI is saved in savedir, several AOIs in savedir/aoi1, savedir/aoi2...
+    outdirs = [savedir] if len(cutranges) == 1 else [savedir.joinpath(f'aoi{k+1}') for k in range(len(cutranges))]
+    for outdir in outdirs:
+        if not outdir.exists():
+            outdir.mkdir()
+
+    prmfiles = sorted(directory.glob('*PRM'))
     print(f'Num of PRM files found: {len(prmfiles)}')
     slcfiles = [prmf.with_suffix('.SLC') for prmf in prmfiles if prmf.with_suffix('.SLC').exists()]
     print(f'Num of SLC files found: {len(slcfiles)}')
@@ -30,44 +41,101 @@ def main():
     if len(prmfiles) != len(slcfiles) != len(ledfiles):
         raise Exception(f'Number of PRM, SLC and LED files do not match')
 
-    print("Cutting SLCs..\n")
-    for prmfile in prmfiles:
-        newstem = prmfile.stem + suffix
-        #newprm = '../' + savedir.joinpath(newstem).as_posix()
-        print(f'File: {prmfile}')
-        slccut_args = ['cut_slc', prmfile.as_posix(), newstem, "/".join(cutrange)]
-        if not run_command(slccut_args, check=False):
-            raise Exception(f'Sth wrong from slc_cut command. Args: {" ".join(slccut_args)}')
-        print('\n')
-        
-    cutprms = [Path(x) for x in glob.glob(f'*{suffix}*PRM')]
-    cutslcs = [Path(x) for x in glob.glob(f'*{suffix}*SLC')]
-
-    path_savedir = Path.cwd().parent.joinpath(savedir)
-    if path_savedir == directory:
-        raise Exception(f'We are not saving cut files in same directory')
-    
-    # Moving files to Savedir
-    print(f"Moving files to: {path_savedir}")
-    for cutprm, cutslc in zip(cutprms, cutslcs):
-        newcutprm = "_".join(cutprm.stem.split("_")[:-1]) + cutprm.suffix
-        newcutslc = "_".join(cutslc.stem.split("_")[:-1]) + cutslc.suffix
-        cutprm.rename(path_savedir.joinpath(newcutprm))
-        cutslc.rename(path_savedir.joinpath(newcutslc))
+    print(f"Cutting SLCs in {len(cutranges)} AOIs with {jobs} jobs..\n")
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        if nativeflag:
+            windows = [[int(x) for x in cutrange] for cutrange in cutranges]
+            results = list(pool.map(lambda prmf: crop_native(prmf, outdirs, windows), prmfiles))
+        else:
+            tasks = [(prmf, outdir, cutrange) for prmf in prmfiles for outdir, cutrange in zip(outdirs, cutranges)]
+            results = list(pool.map(lambda x: cut_slc(*x), tasks))
 
     # Symlinks of LED files
-    for ledfile in ledfiles:
-        path_savedir.joinpath(ledfile).symlink_to(current_cwd.joinpath(ledfile))
+    for outdir in outdirs:
+        for ledfile in ledfiles:
+            link = outdir.joinpath(ledfile.name)
+            if not link.is_symlink():
+                link.symlink_to(ledfile)
+
+    # cut_slc runs one job per SLC and AOI, an SLC is cut when all its jobs succeeded
+    failed = [x for x in results if not x['ok']]
+    nslcs = len({x['prm'] for x in results})
+    nfailed = len({x['prm'] for x in failed})
+    print(f'SUMMARY: Num of SLCs: {nslcs}. Num of SLCs cut: {nslcs - nfailed}. Num of SLCs with issues: {nfailed}')
+    if len(results) != nslcs:
+        print(f'Num of cut_slc jobs: {len(results)}. Num of jobs with issues: {len(failed)}')
+    for result in failed:
+        print(f'FAILED: {result["prm"]} {result.get("savedir", "")}\n{result["message"]}')
 
     print("Done")
-    return 0
+    return 0 if not failed else 1
+
+
+def cut_slc(prmfile: Path, savedir: Path, cutrange: list) -> dict:
+    """
+    Runs cut_slc for one PRM/SLC pair in its own folder inside savedir and moves the result to
+    savedir with the original stem. Failures are reported, not raised, so the batch continues
+    """
+    result = {'prm': prmfile.as_posix(), 'savedir': savedir.as_posix(), 'ok': False, 'seconds': 0.0, 'message': ''}
+    jobdir = savedir.joinpath(f'.cut_{prmfile.stem}')
+    newstem = prmfile.stem + suffix
+    start = time.time()
+    try:
+        jobdir.mkdir(exist_ok=True)
+        for src in [prmfile, prmfile.with_suffix('.SLC')]:
+            link = jobdir.joinpath(src.name)
+            if not link.is_symlink():
+                link.symlink_to(src)
+
+        slccut_args = ['cut_slc', prmfile.name, newstem, "/".join(cutrange)]
+        output = subprocess.run(slccut_args, cwd=jobdir, capture_output=True, text=True)
+        if output.returncode != 0:
+            raise Exception(f'Sth wrong from slc_cut command. Args: {" ".join(slccut_args)}\n{output.stdout}{output.stderr}')
+
+        # Moving files to Savedir
+        for ext in ['.PRM', '.SLC']:
+            cutfile = jobdir.joinpath(newstem + ext)
+            if not cutfile.exists():
+                raise Exception(f'cut_slc did not write: {cutfile.name}')
+            cutfile.rename(savedir.joinpath(prmfile.stem + ext))
+    except Exception as e:
+        result['message'] = str(e)
+    else:
+        result['ok'] = True
+    finally:
+        shutil.rmtree(jobdir, ignore_errors=True)
+
+    result['seconds'] = time.time() - start
+    print(f'File: {prmfile.name} {"done" if result["ok"] else "FAILED"} in {result["seconds"]:.1f} s')
+    return result
+
+
+def crop_native(prmfile: Path, outdirs: list, windows: list) -> dict:
+    """
+    Crops all windows from one PRM/SLC pair in a single read of the SLC, without GMTSAR.
+    Output keeps the original stem in each outdir
+    """
+    result = {'prm': prmfile.as_posix(), 'ok': False, 'seconds': 0.0, 'message': ''}
+    start = time.time()
+    try:
+        crop_slc(prmfile.with_suffix('.SLC'), prmfile, windows, [outdir.joinpath(prmfile.stem) for outdir in outdirs])
+    except Exception as e:
+        result['message'] = str(e)
+    else:
+        result['ok'] = True
+
+    result['seconds'] = time.time() - start
+    print(f'File: {prmfile.name} {"done" if result["ok"] else "FAILED"} in {result["seconds"]:.1f} s')
+    return result
 
 
 def get_args():
-    mess = "Cut SLCs in folder and save them in a given directory, it makes use of cut_slc from GMTSAR"
+    mess = "Cut SLCs in folder and save them in a given directory, it makes use of cut_slc from GMTSAR or crops natively with --native"
 
     example = """EXAMPLE:
        cut_slc_batch.py -d path/to/projectdir -s /save/dir -c 200 2000 500 12000
+       cut_slc_batch.py -d path/to/projectdir -s /save/dir -c 200 2000 500 12000 --jobs 8
+       cut_slc_batch.py -d path/to/projectdir -s /save/dir -c 200 2000 500 12000 -c 3000 4000 100 900 --native
         """
 
     parser = argparse.ArgumentParser(description=mess, epilog=example,
@@ -76,8 +144,10 @@ def get_args():
     # Required arguments
     parser.add_argument('-d', '--directory', dest='directory', required=True, type=Path, help='Path to directory with SLCs to cut')
     parser.add_argument('-s', '--savedir', dest='savedir', required=True, type=Path, help='Path to directory to save cut SLCs')
-    parser.add_argument('-c', '--cut', dest='cutrange', required=True, nargs=4, type=str, help='Cut range: xmin xmax ymin ymax')
+    parser.add_argument('-c', '--cut', dest='cutrange', required=True, nargs=4, type=str, action='append', help='Cut range: xmin xmax ymin ymax. Repeat for several AOIs')
+    parser.add_argument('--native', dest='nativeflag', action='store_true', default=False, help='Crop with numpy instead of cut_slc, all AOIs in one read of each SLC. xmax and ymax are excluded')
+    parser.add_argument('--jobs', dest='jobs', type=int, default=1, help='Number of cut_slc commands run at the same time. Default: 1')
     return parser.parse_args()
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
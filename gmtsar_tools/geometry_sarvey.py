@@ -4,9 +4,11 @@ from pathlib import Path
 from netCDF4 import Dataset as NetCDFFile
 import numpy as np
 import h5py as h5
-import subprocess
-from gmtsar_tools.utils import headingFromLED
-from mintpy.utils import readfile
+import multiprocessing
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from gmtsar_tools.utils.metadata import get_metadata
 
 
 """
@@ -17,80 +19,100 @@ grdGeometryFiles = {'azimuthAngle':'azimuth.grd', 'incidenceAngle':'incidence.gr
                     'longitude':'longitude.grd', 'height':'topo_ra_full.grd', 'slantRangeDistance':'slantRange.grd',
                     'shadowMask':''}
 
-def main(*, topopath: Path):
-    topopath = topopath.resolve()
+# netCDF handles opened by each reader process: {path: Dataset}
+_nc_files = dict()
 
-    # Check dimensions for first dataset and set it as reference
-    geomf = list(grdGeometryFiles.values())[0]
-    dims = NetCDFFile(topopath.joinpath(geomf).as_posix()).variables['z'].shape
-    print(f'Geometry dataset dimensions: {dims}')
 
-    for grdfile in grdGeometryFiles.values():
-        if not grdfile:
-            continue
-        filepath = topopath.joinpath(grdfile)
-        grddims = NetCDFFile(filepath.as_posix()).variables['z'].shape
-        if grddims != dims:
-                raise Exception(f'File: {grdfile} dimensions: {grddims} do not match with dataset dimensions: {dims}\nPlease Check')
+def main(*, topopath: Path, chunks=None, compression='lzf', complevel=4, shuffle=False, blockrows=1024, workers=4):
+    topopath = topopath.resolve()
 
     # Getting metadata
-    meta = get_metadata(topopath)
+    meta = get_metadata(topopath, 'geometry')
 
     #   writing to h5file
     print(f'Writing geometryRadar.h5 stack')
-    with h5.File('geometryRadar.h5', 'w') as dst:
+    with ExitStack() as files:
+        grids = dict()
+        paths = dict()
         for dset, grdfile in grdGeometryFiles.items():
-            print(f'Writing {dset}...')
-            if dset == 'shadowMask':
-                data = np.zeros(dims, dtype=bool)
-                dst.create_dataset(dset, data=data, dtype=data.dtype, shape=data.shape, chunks=True, compression='lzf')
-            else:
-                filepath = topopath.joinpath(grdfile)
-                nc = NetCDFFile(filepath.as_posix())
-                data = nc.variables['z'][:]
-                dst.create_dataset(dset, data=data, dtype=data.dtype, shape=data.shape, chunks=True, compression='lzf')
+            if not grdfile:
+                continue
+            paths[dset] = topopath.joinpath(grdfile).as_posix()
+            nc = files.enter_context(NetCDFFile(paths[dset]))
+            nc.set_auto_mask(False)
+            grids[dset] = nc.variables['z']
+
+        # Check dimensions for first dataset and set it as reference
+        dims = next(iter(grids.values())).shape
+        print(f'Geometry dataset dimensions: {dims}')
+        for dset, z in grids.items():
+            if z.shape != dims:
+                raise Exception(f'File: {grdGeometryFiles[dset]} dimensions: {z.shape} do not match with dataset dimensions: {dims}\nPlease Check')
+
+        dst = files.enter_context(h5.File('geometryRadar.h5', 'w'))
+        h5opts = dataset_options(dims, chunks, compression, complevel, shuffle)
+        for dset, z in grids.items():
+            dst.create_dataset(dset, shape=dims, dtype=z.dtype, **h5opts)
+        # shadowMask is all False, unwritten chunks are filled on read
+        dst.create_dataset('shadowMask', shape=dims, dtype=bool, fillvalue=False, **h5opts)
+
+        write_blocks(paths, dims, dst, blockrows=blockrows, workers=workers)
+
         # Metadata
         print(f'Writing Metadata...')
         for key in meta.keys():
             dst.attrs[key] = meta[key]
 
 
-def get_metadata(topopath: Path):
-    # Check master PRM
-    masterPRM = topopath.joinpath('master.PRM')
-    if not masterPRM.exists():
-        raise Exception('master.PRM seems not to exist. Please check')
-    # Read and add parameters to meta
-    meta = readfile.read_gmtsar_prm(masterPRM)
-
-    # Check if LED is in folder
-    grepOut = subprocess.run(['grep', 'led_file', masterPRM.as_posix()], capture_output=True, text=True)
-    LEDfile = topopath.joinpath(grepOut.stdout.split("=")[1].strip())
-    if not LEDfile.exists():
-        raise Exception('Seems that LED file does not exist. Please check')
-    meta['HEADING'] = headingFromLED(LEDfile)
-
-    # Getting info from topo, inc and slantrange grd files
-    topoInfo = subprocess.run(['gmt', 'grdinfo',  topopath.joinpath('topo_ra_full.grd').as_posix(), '-C'], capture_output=True, text=True)
-    meta['starting_azimuth_line'] = topoInfo.stdout.split("\t")[1] #xmin
-    meta['XMIN'] = topoInfo.stdout.split("\t")[1] 
-    meta['XMAX'] = topoInfo.stdout.split("\t")[2]
-    meta['YMIN'] = topoInfo.stdout.split("\t")[3]
-    meta['YMAX'] = topoInfo.stdout.split("\t")[4]
-    meta['ALOOKS'] = topoInfo.stdout.split("\t")[7] #xinc
-    meta['RLOOKS'] = topoInfo.stdout.split("\t")[8] #yinc
-    meta['WIDTH'] = topoInfo.stdout.split("\t")[9]
-    meta['LENGTH'] = topoInfo.stdout.split("\t")[10]
-    incInfo = subprocess.run(['gmt', 'grdinfo',  topopath.joinpath('incidence.grd').as_posix(), '-C', '-L2'], capture_output=True, text=True)
-    meta['INCIDENCE_ANGLE'] = float(incInfo.stdout.split("\t")[11]) #incMean
-    slantInfo = subprocess.run(['gmt', 'grdinfo',  topopath.joinpath('slantRange.grd').as_posix(), '-C', '-L2'], capture_output=True, text=True)
-    meta['SLANT_RANGE_DISTANCE'] = float(slantInfo.stdout.split("\t")[11]) #slantMean
-    meta['FILE_TYPE'] = 'geometry'
-    meta['PROCESSOR'] = 'isce' # needed in case we use file for mintpy
-    meta['AZIMUTH_PIXEL_SIZE'] *= int(meta['ALOOKS'])
-    meta['RANGE_PIXEL_SIZE'] *= int(meta['RLOOKS'])
-    meta = readfile.standardize_metadata(meta)
-    return meta
+def dataset_options(dims, chunks=None, compression='lzf', complevel=4, shuffle=False) -> dict:
+    """
+    h5py create_dataset options. chunks None lets h5py guess the chunk shape, compression: lzf, gzip or none
+    """
+    chunks = tuple(min(c, d) for c, d in zip(chunks, dims)) if chunks else True
+    if compression == 'none':
+        return {'chunks': chunks, 'shuffle': shuffle}
+    elif compression == 'gzip':
+        return {'chunks': chunks, 'compression': 'gzip', 'compression_opts': complevel, 'shuffle': shuffle}
+    elif compression == 'lzf':
+        return {'chunks': chunks, 'compression': 'lzf', 'shuffle': shuffle}
+    raise Exception(f'Compression not supported: {compression}. Use lzf, gzip or none')
+
+
+def _read_block(path, r0, r1):
+    nc = _nc_files.get(path)
+    if nc is None:
+        nc = _nc_files[path] = NetCDFFile(path)
+        nc.set_auto_mask(False)
+    return np.ascontiguousarray(nc.variables['z'][r0:r1])
+
+
+def write_blocks(paths: dict, dims, dst, blockrows=1024, workers=4):
+    """
+    Streams grids {dataset: grd path} of shape dims into preallocated datasets of dst in blocks of rows.
+    Blocks are read by spawned worker processes (clean libnetcdf/libhdf5 state) with their own netCDF handles,
+    at most 2*workers blocks are in flight.
+    Writes (and compression) happen in the calling process, overlapping with the reads of next blocks
+    """
+    tasks = [(dset, r0, min(r0 + blockrows, dims[0])) for dset in paths for r0 in range(0, dims[0], blockrows)]
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        try:
+            for dset, r0, r1 in tasks:
+                pending.append((dset, r0, r1, pool.submit(_read_block, paths[dset], r0, r1)))
+                while len(pending) >= 2 * workers:
+                    _write_block(dst, *pending.popleft())
+            while pending:
+                _write_block(dst, *pending.popleft())
+        except BaseException:
+            for *_, future in pending:
+                future.cancel()
+            raise
+
+
+def _write_block(dst, dset, r0, r1, future):
+    if r0 == 0:
+        print(f'Writing {dset}...')
+    dst[dset][r0:r1] = future.result()
 
 
 def get_args():
@@ -98,6 +120,7 @@ def get_args():
 
     example = """EXAMPLE:
      geometry_sarvey.py path/to/topo
+     geometry_sarvey.py path/to/topo --compression gzip --complevel 6 --shuffle --chunks 256 256
         """
 
     parser = argparse.ArgumentParser(description=mess, epilog=example,
@@ -105,11 +128,18 @@ def get_args():
 
     # Required arguments
     parser.add_argument('topopath', type=Path, help='Path to topo directory')
+    parser.add_argument('--chunks', type=int, nargs=2, default=None, help='HDF5 chunk shape (rows cols). Default: chosen by h5py')
+    parser.add_argument('--compression', type=str, choices=['lzf', 'gzip', 'none'], default='lzf', help='HDF5 compression. Default: lzf')
+    parser.add_argument('--complevel', type=int, default=4, help='gzip compression level (0-9). Default: 4')
+    parser.add_argument('--shuffle', action='store_true', help='Apply HDF5 shuffle filter before compression')
+    parser.add_argument('--blockrows', type=int, default=1024, help='Rows read per block. Default: 1024')
+    parser.add_argument('--workers', type=int, default=4, help='Processes reading grid blocks. Default: 4')
 
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = get_args()
-    main(topopath=args.topopath)
+    main(topopath=args.topopath, chunks=args.chunks, compression=args.compression, complevel=args.complevel,
+         shuffle=args.shuffle, blockrows=args.blockrows, workers=args.workers)
 
@@ -1,12 +1,17 @@
 #!/usr/bin/env python
 
 import os
+import sys
+import glob
 from netCDF4 import Dataset as NetCDFFile
+import matplotlib
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import argparse
 from pathlib import Path
 from typing import Union
+from gmtsar_tools.utils import read_grd_overview, axes_pixels
 import pdb
 
 #         colormap = 'terrain'
@@ -14,8 +19,86 @@ import pdb
 #         maxv = np.max(z) + 100
 
 
+class LazyGridView:
+    """
+    Interactive view of a grid that never loads it whole: the image is read with strided NetCDF reads
+    (nearest sample every stride rows/cols) so it fits the axes in pixels. On pan or zoom, once limits settle for
+    delay ms, only the visible window is read again at the stride that fits the axes.
+    Rows and cols are mapped to the full extent as imshow does (row 0 on top)
+    """
+
+    def __init__(self, filepath: Path, ax, llflag=False, delay=200):
+        self.nc = NetCDFFile(filepath.as_posix())
+        self.nc.set_auto_mask(False)
+        self.z = self.nc.variables['z']
+        self.nrows, self.ncols = self.z.shape
+        xv = self.nc.variables['lon' if llflag else 'x']
+        yv = self.nc.variables['lat' if llflag else 'y']
+        x0, x1 = float(xv[0]), float(xv[-1])
+        y0, y1 = float(yv[0]), float(yv[-1])
+        self.extent = [min(x0, x1), max(x0, x1), min(y0, y1), max(y0, y1)]
+        self.ax = ax
+        self.im = None
+        self.timer = ax.figure.canvas.new_timer(interval=delay)
+        self.timer.single_shot = True
+        self.timer.add_callback(self.update)
+
+    def read(self, xlim, ylim):
+        """
+        Strided read of the window inside xlim, ylim. Returns z and its extent
+        """
+        X0, X1, Y0, Y1 = self.extent
+        px = (X1 - X0) / self.ncols if X1 > X0 else 1.0
+        py = (Y1 - Y0) / self.nrows if Y1 > Y0 else 1.0
+        c0 = int(np.clip(np.floor((min(xlim) - X0) / px), 0, self.ncols - 1))
+        c1 = int(np.clip(np.ceil((max(xlim) - X0) / px), c0 + 1, self.ncols))
+        r0 = int(np.clip(np.floor((Y1 - max(ylim)) / py), 0, self.nrows - 1))
+        r1 = int(np.clip(np.ceil((Y1 - min(ylim)) / py), r0 + 1, self.nrows))
+
+        rows, cols = axes_pixels(self.ax)
+        sy = max(1, (r1 - r0) // max(rows, 1))
+        sx = max(1, (c1 - c0) // max(cols, 1))
+        z = self.z[r0:r1:sy, c0:c1:sx]
+        re, ce = min(r0 + z.shape[0] * sy, self.nrows), min(c0 + z.shape[1] * sx, self.ncols)
+        extent = [X0 + c0 * px, X0 + ce * px, Y1 - re * py, Y1 - r0 * py]
+        return z, extent
+
+    def draw(self, cmap, aspect, vmin=None, vmax=None):
+        X0, X1, Y0, Y1 = self.extent
+        z, extent = self.read((X0, X1), (Y0, Y1))
+        if vmin is None and vmax is None:
+            vmin, vmax = np.nanmin(z), np.nanmax(z)
+        self.im = self.ax.imshow(z, extent=extent, cmap=cmap, aspect=aspect, interpolation='nearest', vmin=vmin, vmax=vmax)
+        self.ax.set_xlim(X0, X1)
+        self.ax.set_ylim(Y0, Y1)
+        self.ax.set_autoscale_on(False)
+        # callbacks are closures so the view is kept alive with the axes
+        self.ax.callbacks.connect('xlim_changed', lambda ax: self.schedule())
+        self.ax.callbacks.connect('ylim_changed', lambda ax: self.schedule())
+        self.ax.figure.canvas.mpl_connect('close_event', lambda event: self.close())
+        return self.im
+
+    def schedule(self):
+        # zoom and pan change both limits, read once they settle
+        self.timer.stop()
+        self.timer.start()
+
+    def update(self):
+        if not self.nc.isopen():
+            return
+        z, extent = self.read(self.ax.get_xlim(), self.ax.get_ylim())
+        self.im.set_data(z)
+        self.im.set_extent(extent)
+        self.ax.figure.canvas.draw_idle()
+
+    def close(self):
+        self.timer.stop()
+        if self.nc.isopen():
+            self.nc.close()
+
+
 def main(*, filepath: Path, cmap: str, minmaxv: list, figsize: tuple, aspect: Union[None, float], title: str, xlabel: str, 
-         ylabel: str, llflag: bool, flipy: bool, flipx: bool, showflag: bool=True):
+         ylabel: str, llflag: bool, flipy: bool, flipx: bool, showflag: bool=True, fullres: bool=False, lazy: bool=False):
     aspect = aspect if aspect else 'auto'
     vmin, vmax = minmaxv
 
@@ -25,26 +108,38 @@ def main(*, filepath: Path, cmap: str, minmaxv: list, figsize: tuple, aspect: Un
     if not title:
         title = filepath.name
 
+    fig, ax = plt.subplots(figsize=figsize, constrained_layout=True)
+
     # open grd file
-    nc = NetCDFFile(filepath.as_posix())
-    if llflag:
-        x = nc.variables['lon'][:]
-        y = nc.variables['lat'][:]
-        z = nc.variables['z'][:]
+    if lazy:
+        view = LazyGridView(filepath, ax, llflag=llflag)
+        im = view.draw(cmap, aspect, vmin=vmin, vmax=vmax)
+    elif fullres:
+        nc = NetCDFFile(filepath.as_posix())
+        if llflag:
+            x = nc.variables['lon'][:]
+            y = nc.variables['lat'][:]
+            z = nc.variables['z'][:]
 
+        else:
+            x = nc.variables['x'][:]
+            y = nc.variables['y'][:]
+            z = nc.variables['z'][:]
+        extent = [np.min(x), np.max(x), np.min(y), np.max(y)]
     else:
-        x = nc.variables['x'][:]
-        y = nc.variables['y'][:]
-        z = nc.variables['z'][:]
-        
-    if vmin is None and vmax is None:
-        vmin = np.min(z)
-        vmax = np.max(z)
-
-    # PLOT
-    fig, ax = plt.subplots(figsize=figsize, constrained_layout=True)
-    im = ax.imshow(z, extent=[np.min(x), np.max(x), np.min(y), np.max(y)], cmap=cmap, 
-                       aspect=aspect, interpolation='nearest', vmin=vmin, vmax=vmax)
+        # coarsest overview level with at least the axes size in pixels
+        z, extent, factor = read_grd_overview(filepath, axes_pixels(ax))
+        if factor > 1:
+            print(f'Using {factor}x overview')
+
+    if not lazy:
+        if vmin is None and vmax is None:
+            vmin = np.nanmin(z)
+            vmax = np.nanmax(z)
+
+        # PLOT
+        im = ax.imshow(z, extent=extent, cmap=cmap, 
+                           aspect=aspect, interpolation='nearest', vmin=vmin, vmax=vmax)
     fig.colorbar(im, fraction=0.046, pad=0.04)
     ax.set_title(title)
     ax.set_xlabel(xlabel)
@@ -61,11 +156,148 @@ def main(*, filepath: Path, cmap: str, minmaxv: list, figsize: tuple, aspect: Un
         return ax
 
 
+def batch(*, grids: list, outdir: Union[None, Path], cmap: str, minmaxv: list, percentiles: list, figsize: tuple,
+          aspect: Union[None, float], xlabel: str, ylabel: str, llflag: bool, flipy: bool, flipx: bool, fullres: bool,
+          skipnewer: bool, jobs: int, dpi: int):
+    """
+    Renders grids to PNG in a process pool with Agg backend. Color limits are shared by all grids: given by minmaxv
+    or taken at percentiles of strided samples of every grid (pre-pass). PNGs are written next to each grid,
+    or in outdir as <parent>_<name>.png
+    """
+    paths = list()
+    for pattern in grids:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        paths += [Path(x) for x in matches]
+    paths = list(dict.fromkeys(paths))
+    if not paths:
+        raise Exception(f'No grids found: {grids}')
+    if outdir and not outdir.exists():
+        outdir.mkdir(parents=True)
+    outfiles = [outdir.joinpath(f'{x.parent.name}_{x.stem}.png') if outdir else x.with_suffix('.png') for x in paths]
+
+    todo = [(x, out) for x, out in zip(paths, outfiles) if not (skipnewer and _is_newer(out, x))]
+    print(f'Num of grids: {len(paths)}. Num of images to render: {len(todo)}')
+    if not todo:
+        return 0
+
+    failed = dict()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as pool:
+        vmin, vmax = minmaxv
+        if vmin is None and vmax is None:
+            samples = list()
+            for x, sample in zip(paths, pool.map(_sample_worker, paths)):
+                if sample is None:
+                    failed[x] = 'sampling'
+                else:
+                    samples.append(sample)
+            samples = np.concatenate(samples) if samples else np.empty(0, dtype=np.float32)
+            if samples.size > 0:
+                vmin, vmax = (float(x) for x in np.percentile(samples, percentiles))
+                print(f'Shared color limits: {vmin} {vmax}')
+            else:
+                print('No finite values sampled, color limits taken from each grid')
+
+        opts = dict(cmap=cmap, minmaxv=[vmin, vmax], figsize=figsize, aspect=aspect, xlabel=xlabel, ylabel=ylabel,
+                    llflag=llflag, flipy=flipy, flipx=flipx, fullres=fullres, dpi=dpi)
+        results = list(pool.map(_render, [x for x, _ in todo], [out for _, out in todo], [opts] * len(todo)))
+
+    nrendered = 0
+    for (x, _), r in zip(todo, results):
+        if r != 0:
+            failed[x] = 'rendering'
+        else:
+            nrendered += 1
+    print(f'SUMMARY: Num of images rendered: {nrendered}. Num of grids with issues: {len(failed)}')
+    for x, step in failed.items():
+        print(f'Grid with issues ({step}): {x}')
+    return 1 if failed else 0
+
+
+def _is_newer(outfile: Path, filepath: Path) -> bool:
+    try:
+        return outfile.stat().st_mtime > filepath.stat().st_mtime
+    except OSError:
+        return False
+
+
+def _sample_worker(filepath: Path):
+    try:
+        return sample_grid(filepath)
+    except Exception as e:
+        print(f'Exception sampling grid: {filepath}\nException: {e}')
+        return None
+
+
+def sample_grid(filepath: Path, nsamples=256):
+    """
+    Finite values of a strided read of z, about nsamples x nsamples
+    """
+    with NetCDFFile(Path(filepath).as_posix()) as nc:
+        nc.set_auto_mask(False)
+        z = nc.variables['z']
+        sy, sx = max(1, z.shape[0] // nsamples), max(1, z.shape[1] // nsamples)
+        sample = np.asarray(z[::sy, ::sx], dtype=np.float32).ravel()
+    return sample[np.isfinite(sample)]
+
+
+def _render(filepath: Path, outfile: Path, opts: dict):
+    try:
+        ax = main(filepath=filepath, title=f'{filepath.parent.name}/{filepath.name}', showflag=False,
+                  **{k: v for k, v in opts.items() if k != 'dpi'})
+        fig = ax.figure
+        fig.savefig(outfile, dpi=opts['dpi'])
+        plt.close(fig)
+    except Exception as e:
+        print(f'Exception rendering grid: {filepath}\nException: {e}')
+        return -1
+    print(f'Image saved as: {outfile}')
+    return 0
+
+
+def _init_worker():
+    matplotlib.use('Agg', force=True)
+
+
+def get_batch_args(argv):
+    mess = "Renders grd files from GMTSAR to PNG images in parallel, with shared color limits"
+
+    example = """EXAMPLE:
+       grdv.py batch "intf/*/phasefilt.grd" -o qa/phasefilt --jobs 8 -c jet
+       grdv.py batch "intf/*/corr.grd" -v 0 1 -c gray --skip-newer
+       grdv.py batch "intf/*/unwrap.grd" -p 2 98 --jobs 8
+        """
+
+    parser = argparse.ArgumentParser(prog='grdv.py batch', description=mess, epilog=example,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    # Required arguments
+    parser.add_argument('grids', nargs='+', type=str, help='Grid paths or glob patterns (quoted)')
+    # Optional
+    parser.add_argument('-o', '--outdir', dest='outdir', type=Path, default=None, help='Directory for images as <parent>_<name>.png. Default: next to each grid')
+    parser.add_argument('-v', dest='minmaxv', nargs=2, type=float, default=[None, None], help='min and max values: -5 5. Default: shared from pre-pass')
+    parser.add_argument('-p', '--percentiles', dest='percentiles', nargs=2, type=float, default=[0, 100], help='Percentiles of pre-pass samples for color limits. Default: 0 100 (min max)')
+    parser.add_argument('--ll', dest='llflag', action='store_true', default=False, help='Georeferenced grid (lon, lat)')
+    parser.add_argument('--xlabel', dest='xlabel', default='x', type=str, help='x axis label')
+    parser.add_argument('--ylabel', dest='ylabel', default='y', type=str, help='y axis label')
+    parser.add_argument('-c', '--cmap', dest='cmap', default='jet', help='Cmap, by default jet, terrain for DEM')
+    parser.add_argument('--aspect', dest='aspect', type=float, help='Aspect value, by default auto')
+    parser.add_argument('--figsize', dest='figsize', nargs=2, type=int, default=[6, 6], help='figsize, default: 6 6')
+    parser.add_argument('--dpi', dest='dpi', type=int, default=100, help='Image dpi. Default: 100')
+    parser.add_argument('--flipy', dest='flipy', action='store_true', default=False, help='Flips Y axis')
+    parser.add_argument('--flipx', dest='flipx', action='store_true', default=False, help='Flips X axis')
+    parser.add_argument('--fullres', dest='fullres', action='store_true', default=False, help='Render full resolution grids instead of multilooked overviews')
+    parser.add_argument('--skip-newer', dest='skipnewer', action='store_true', default=False, help='Skip grids whose image is newer than the grid')
+    parser.add_argument('--jobs', dest='jobs', type=int, default=4, help='Number of grids rendered in parallel. Default: 4')
+    return parser.parse_args(argv)
+
+
 def get_args():
     mess = "View grd files from GMTSAR with matplotlib"
 
     example = """EXAMPLE:
        grdv.py /path/to/file --ll -v 12 12 -c viridis -t mytitle --aspect 0.2 --figsize 8 8 --flipy --flix
+       grdv.py /path/to/large_file.grd --ll --lazy
+       grdv.py batch "intf/*/corr.grd" -o qa --jobs 8   (see grdv.py batch -h)
         """
 
     parser = argparse.ArgumentParser(description=mess, epilog=example,
@@ -84,11 +316,21 @@ def get_args():
     parser.add_argument('--figsize', dest='figsize', nargs=2, type=int, default=[6, 6], help='figsize, default: 10 10')
     parser.add_argument('--flipy', dest='flipy', action='store_true', default=False, help='Flips Y axis')
     parser.add_argument('--flipx', dest='flipx', action='store_true', default=False, help='Flips X axis')
+    parser.add_argument('--lazy', dest='lazy', action='store_true', default=False, help='Interactive mode: decimated view, visible window is read again on zoom and pan')
+    parser.add_argument('--fullres', dest='fullres', action='store_true', default=False, help='Plot full resolution grid instead of multilooked overview')
     return parser.parse_args()
 
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        matplotlib.use('Agg')
+        args = get_batch_args(sys.argv[2:])
+        r = batch(grids=args.grids, outdir=args.outdir, cmap=args.cmap, minmaxv=args.minmaxv, percentiles=args.percentiles,
+                  figsize=tuple(args.figsize), aspect=args.aspect, xlabel=args.xlabel, ylabel=args.ylabel, llflag=args.llflag,
+                  flipy=args.flipy, flipx=args.flipx, fullres=args.fullres, skipnewer=args.skipnewer, jobs=args.jobs, dpi=args.dpi)
+        sys.exit(r)
     args = get_args()
     main(filepath=args.grdpath, cmap=args.cmap, minmaxv=args.minmaxv, figsize=tuple(args.figsize), aspect=args.aspect, 
-         title=args.title, xlabel=args.xlabel, ylabel=args.ylabel, llflag=args.llflag, flipy=args.flipy, flipx=args.flipx)
\ No newline at end of file
+         title=args.title, xlabel=args.xlabel, ylabel=args.ylabel, llflag=args.llflag, flipy=args.flipy, flipx=args.flipx,
+         fullres=args.fullres, lazy=args.lazy)
\ No newline at end of file
@@ -5,9 +5,7 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.collections import LineCollection
-from datetime import datetime
-from gmtsar_tools.utils import read_baseline_table
-import glob
+from gmtsar_tools.utils import read_baseline_table, Catalog
 import pdb
 
 
@@ -16,6 +14,7 @@ def main():
     baseline_table = args.baseline_table
     intf_dir = args.intf_dir
     intf_out = args.intf_out
+    catalog_path = args.catalog
 
     data = read_baseline_table(baseline_table)
     fig, ax = plt.subplots(figsize=(12,8))
@@ -26,29 +25,23 @@ def main():
     xmin, xmax = yearfrac.min(), yearfrac.max()
     ymin, ymax = bperp.min(), bperp.max()
 
+    # Orbit lookup: sat_orb -> row in table
+    orb_index = {orb: k for k, orb in enumerate(sat_orb)}
+
+    with Catalog(catalog_path if catalog_path else intf_dir.resolve().parent) as catalog:
+        catalog.refresh_intfs(intf_dir)
+        intfs = catalog.intfs(intf_dir)
+
     pairs = list()
     stem_pairs_list = list()
-    i = 0
-    for intf in intf_dir.iterdir():
-        if intf.is_dir() and "_" in intf.name and len(intf.name.split("_")) == 2:
-            print(f'Intf: {intf}')
-            prms = glob.glob(f'{intf}/*PRM')
-            prms.sort(key=lambda x: datetime.strptime(x.split("/")[-1][14:22], "%Y%m%d").date())
-            if len(prms) !=2:
-                print(f'WARNING: PRM files in: {intf} is different from two\nPRMs: {prms}')
-                continue
-            masterPRM, slavePRM = prms
-            orbmaster = masterPRM.split("/")[-1].split("_")[-2]
-            orbslave = slavePRM.split("/")[-1].split("_")[-2]
-            row_master = data.loc[data.sat_orb == orbmaster]
-            row_slave = data.loc[data.sat_orb == orbslave]
-            bperp1, bperp2 = row_master['Bperp'].values[0], row_slave['Bperp'].values[0]
-            p1 = [row_master['aligned_time'].values[0], bperp1]
-            p2 = [row_slave['aligned_time'].values[0], bperp2]
-            pairs.append([p1,p2])
-            stem_pair = f'{masterPRM.split("/")[-1].split(".")[0]}:{slavePRM.split("/")[-1].split(".")[0]}'
-            stem_pairs_list.append(stem_pair)
-            i += 1
+    for intf in intfs:
+        print(f'Intf: {intf["path"]}')
+        if intf['nprm'] !=2:
+            print(f'WARNING: PRM files in: {intf["path"]} is different from two\nNum of PRMs: {intf["nprm"]}')
+            continue
+        k1, k2 = orb_index[intf['ref_orbit']], orb_index[intf['sec_orbit']]
+        pairs.append([[yearfrac[k1], bperp[k1]], [yearfrac[k2], bperp[k2]]])
+        stem_pairs_list.append(f'{intf["ref_stem"]}:{intf["sec_stem"]}')
 
     collection = LineCollection(pairs, colors='darkorange', linewidths=0.6, alpha=0.7, linestyle='solid', label='network')
     xticks = np.arange(int(np.floor(xmin)), int(np.ceil(xmax)+1), 0.5)
@@ -91,6 +84,7 @@ def get_args():
     parser.add_argument('baseline_table', type=Path, help='Path to baseline_table.dat')
     parser.add_argument('intf_dir', type=Path, help='Path to intf directory')
     parser.add_argument('--intf', dest='intf_out', default=None, help='Name of optionally writing intf_out.in')
+    parser.add_argument('--catalog', dest='catalog', type=Path, default=None, help='Project catalog (SQLite file or directory). Default: parent of intf directory')
     return parser.parse_args()
 
 
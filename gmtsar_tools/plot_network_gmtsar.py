@@ -4,10 +4,9 @@ from pathlib import Path
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from itertools import combinations
 from matplotlib.collections import LineCollection
 from datetime import datetime, date
-from gmtsar_tools.utils import read_baseline_table, str2date
+from gmtsar_tools.utils import read_baseline_table, str2date, candidate_pairs, edge_weights, optimize_network
 import glob
 import pdb
 
@@ -25,6 +24,11 @@ def main():
     current_network = args.current_network
     exclude_intf = args.exclude_intf
     outfile = args.outfile
+    optimize = args.optimize
+    minconn = args.minconn
+    maxpairs = args.maxpairs
+    tau = args.tau
+    bcrit = args.bcrit
 
     if slcdir:
         slcs = glob.glob(f'{slcdir}/*.SLC')
@@ -40,52 +44,62 @@ def main():
     xmin, xmax = yearfrac.min(), yearfrac.max()
     ymin, ymax = bperp.min(), bperp.max()
 
+    # Orbit lookup: sat_orb -> row in table
+    orb_index = {orb: k for k, orb in enumerate(sat_orb)}
+
     # if I give a previous intf.in
     pairs_current_network = list()
-    current_ifgs = list()
+    current_ifgs = set()
     if current_network:
         with open(current_network, 'r') as ifgs:
             print(f'Reading current network: {current_network}')
             for pair in ifgs:
-                current_ifgs.append(pair)
-                master, slave = pair.strip().split(":")
-                orbmaster = master.split("_")[-2]
-                orbslave = slave.split("_")[-2]
-                row_master = data.loc[data.sat_orb == orbmaster]
-                row_slave = data.loc[data.sat_orb == orbslave]
-                bperp1, bperp2 = row_master['Bperp'].values[0], row_slave['Bperp'].values[0]
-                p1 = [row_master['aligned_time'].values[0], bperp1]
-                p2 = [row_slave['aligned_time'].values[0], bperp2]
-                pairs_current_network.append([p1,p2])
+                pair = pair.strip()
+                if not pair:
+                    continue
+                current_ifgs.add(pair)
+                master, slave = pair.split(":")
+                k1 = orb_index[master.split("_")[-2]]
+                k2 = orb_index[slave.split("_")[-2]]
+                pairs_current_network.append([[yearfrac[k1], bperp[k1]], [yearfrac[k2], bperp[k2]]])
 
     intf_in = list()
     pairs = list()
-    
-    # Making network
-    for im1, im2 in sorted(combinations(data.sat_orb.to_list(), 2)):
-        row_im1 = data.loc[data.sat_orb == im1]
-        row_im2 = data.loc[data.sat_orb == im2]
-        bperp1, bperp2 = row_im1['Bperp'].values[0], row_im2['Bperp'].values[0]
-        t1, t2 = row_im1['aligned_days'].values[0], row_im2['aligned_days'].values[0]
-        dt1 = row_im1['date_dt'].values[0]
-        if dt1 > startdate and dt1 <= enddate:
-            if t1 < t2 and t2 - t1 < maxtbase and t2 - t1 >= mintbase:
-                if abs(bperp2 - bperp1) < maxpbase and abs(bperp2 - bperp1) >= minpbase:
-                    p1 = [row_im1['aligned_time'].values[0], bperp1]
-                    p2 = [row_im2['aligned_time'].values[0], bperp2]
-                    if slcdir:
-                        stem_pair = f'{orb_dict[im1]}:{orb_dict[im2]}'
-                        if stem_pair in current_ifgs:
-                            print(f'Pair {stem_pair} in {current_ifgs}, skip')
-                            continue
-                        else:
-                            intf_in.append(stem_pair)
-                    pairs.append([p1,p2])
-    
+
+    # Making network: candidates within temporal and perpendicular baselines, first date in (start, end]
+    days = data['aligned_days'].to_numpy()
+    firstdates = np.array([x.toordinal() for x in data['date_dt']])
+    valid_first = (firstdates > startdate.toordinal()) & (firstdates <= enddate.toordinal())
+    ii, jj = candidate_pairs(days, bperp, mintbase, maxtbase, minpbase, maxpbase, valid_first=valid_first)
+    if optimize:
+        # Connected network with minimum connections per date, edges ranked by expected coherence if tau and bcrit
+        weights = edge_weights(days[jj] - days[ii], bperp[jj] - bperp[ii], tau=tau, bcrit=bcrit)
+        print(f'Optimizing network from {len(ii)} candidate pairs...')
+        ii, jj, nbridges = optimize_network(days, ii, jj, weights, min_connections=minconn, max_pairs=maxpairs, nodes=valid_first)
+        print(f'Optimized network: {len(ii)} pairs')
+        if nbridges:
+            print(f'{nbridges} pairs outside baseline limits added to connect the network and reach {minconn} connections per date')
+        degree = np.bincount(np.concatenate([ii, jj]), minlength=len(days))
+        below = np.flatnonzero(valid_first & (degree < minconn))
+        if below.size:
+            print(f'WARNING: {below.size} dates with less than {minconn} connections: {", ".join(str(x) for x in sat_orb[below])}')
+    names = sat_orb.astype(str)
+    order = np.lexsort((names[jj], names[ii]))
+    for i, j in zip(ii[order], jj[order]):
+        if slcdir:
+            stem_pair = f'{orb_dict[sat_orb[i]]}:{orb_dict[sat_orb[j]]}'
+            if stem_pair in current_ifgs:
+                print(f'Pair {stem_pair} in {current_network}, skip')
+                continue
+            else:
+                intf_in.append(stem_pair)
+        pairs.append([[yearfrac[i], bperp[i]], [yearfrac[j], bperp[j]]])
+
     # Excluding intf
+    exclude_ifgs = set()
     if exclude_intf:
         if exclude_intf.exists():
-            exclude_ifgs = ifgs_to_exclude(exclude_intf)
+            exclude_ifgs = set(ifgs_to_exclude(exclude_intf))
 
     # writing intf.in
     if intf_in:
@@ -152,6 +166,7 @@ def get_args():
 
     example = """EXAMPLE:
        plot_network_gmtsar.py -f path/to/baseline_table.dat
+       plot_network_gmtsar.py -f path/to/baseline_table.dat --maxt 120 --maxb 150 --slc path/to/SLC --optimize --minconn 3 --maxpairs 2000 --tau 60 --bcrit 300
         """
 
     parser = argparse.ArgumentParser(description=mess, epilog=example,
@@ -170,6 +185,11 @@ def get_args():
     parser.add_argument('--intf', dest='current_network', type=Path, help='Path to intf.in if you have one. It will be plot on top of your network')
     parser.add_argument('--exclude_intf', dest='exclude_intf', default=None, type=Path, help='It will take ifgs from this file to prevent writing them in the new outfile intf.in')
     parser.add_argument('--outfile', type=str, dest='outfile', default='ifgs.in', help='Name for output file with intfs, slcdir needs to be define. Default: ifgs.in')
+    parser.add_argument('--optimize', dest='optimize', action='store_true', default=False, help='Select a connected network from pairs within limits: spanning tree of best pairs, consecutive dates bridge gaps, minimum connections per date')
+    parser.add_argument('--minconn', dest='minconn', type=int, default=2, help='Minimum number of pairs per date with --optimize. Default: 2')
+    parser.add_argument('--maxpairs', dest='maxpairs', type=int, default=None, help='Maximum number of pairs with --optimize, pairs needed for connectivity are always kept')
+    parser.add_argument('--tau', dest='tau', type=float, default=None, help='Coherence decay time in days. With --bcrit pairs are ranked by exp(-Bt/tau)*(1-|Bp|/bcrit)')
+    parser.add_argument('--bcrit', dest='bcrit', type=float, default=None, help='Critical perpendicular baseline in meters, used with --tau')
     return parser.parse_args()
 
 
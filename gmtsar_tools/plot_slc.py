@@ -2,11 +2,15 @@
 import argparse
 from pathlib import Path
 import glob
-from gmtsar_tools.utils import grep
+from gmtsar_tools.utils import read_prm, open_slc, iter_slc_blocks, read_slc_overview
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
 import pdb
 
+FIGSIZE = (10, 8)
+
 
 def main():
     args = get_args()
@@ -16,6 +20,8 @@ def main():
     savedir = args.savedir
     band = args.band
     overwriteflag = args.overwrite
+    fullres = args.fullres
+    jobs = args.jobs
 
     if band is None:
         band = ['phase', 'magnitude', 'normmagnitude']
@@ -36,13 +42,21 @@ def main():
         count = 0
         count_badfiles = 0
         totalslcs = len(slcfiles)
-        for slcfile in slcfiles:
-            prmfile = slcfile.with_suffix('.PRM')
-            r = plot_slc(slcfile, prmfile, savedir, band, showflag, overwriteflag)
+        if jobs > 1:
+            # Figures are rendered off screen in workers
+            if showflag:
+                print('--showflag is ignored with --jobs')
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as pool:
+                results = list(pool.map(_plot_worker, slcfiles, [savedir] * totalslcs, [band] * totalslcs,
+                                        [overwriteflag] * totalslcs, [fullres] * totalslcs))
+        else:
+            results = [plot_slc(slcfile, slcfile.with_suffix('.PRM'), savedir, band, showflag, overwriteflag, fullres)
+                       for slcfile in slcfiles]
+        for slcfile, r in zip(slcfiles, results):
             if r != 0:
                 slcfiles_exceptions.append(slcfile)
                 count_badfiles += 1
-                print(f"Something wrong with plot_slc function\nArguments: {slcfile, prmfile, savedir}. Skipping...")
+                print(f"Something wrong with plot_slc function\nArguments: {slcfile, slcfile.with_suffix('.PRM'), savedir}. Skipping...")
             else:
                 count += 1
         print(f"SUMMARY: Num of SLCs: {totalslcs}. Num of plots creates: {count}. Num of dates with issues: {count_badfiles}")
@@ -56,7 +70,7 @@ def main():
             raise(f'File path seems not to be a SLC file: {filepath}')
 
         prmfile = filepath.with_suffix('.PRM')
-        r = plot_slc(filepath, prmfile, savedir, band, showflag, overwriteflag)
+        r = plot_slc(filepath, prmfile, savedir, band, showflag, overwriteflag, fullres)
         if r != 0:
             raise Exception(f"Something wrong with plot_slc function\nArguments: {filepath, prmfile, savedir}")
 
@@ -65,7 +79,7 @@ def main():
         raise Exception(f'Why I am here?')
 
 
-def plot_slc(slcfile:Path, prmfile:Path, savedir:Path, bands: list, showflag=False, overwriteflag=False):
+def plot_slc(slcfile:Path, prmfile:Path, savedir:Path, bands: list, showflag=False, overwriteflag=False, fullres=False):
     if 'phase' in bands:
         phasefilename = savedir.joinpath(slcfile.stem + '_pha.png')
         if phasefilename.exists():
@@ -115,8 +129,9 @@ def plot_slc(slcfile:Path, prmfile:Path, savedir:Path, bands: list, showflag=Fal
     slcstem = slcfile.stem
     print(f'PRM file: {prmfile}')
     #Get rows and columns
-    nlines = grep(prmfile, 'num_lines')
-    rgbins = grep(prmfile, 'num_rng_bins')
+    prm = read_prm(prmfile)
+    nlines = prm.get('num_lines')
+    rgbins = prm.get('num_rng_bins')
 
     if not nlines:
         raise Exception(f'Error getting nlines: {nlines} from PRM file: {prmfile}')
@@ -128,34 +143,32 @@ def plot_slc(slcfile:Path, prmfile:Path, savedir:Path, bands: list, showflag=Fal
     else:
         rgbins = int(rgbins)
 
-    # Reshape SLC
-    slc_data = np.fromfile(slcfile, dtype=np.int16)
-    slc_data = slc_data.astype(np.float32).view(np.complex64)
     try:
-        slc_data = slc_data.reshape((nlines,rgbins))
+        bands = slc_bands(slcfile, prmfile, plotphase, plotmagn, plotnormmag, fullres)
     except ValueError as e:
         print(f'Problem reshaping slc. PRM file: {prmfile}\nException: {e}')
         return -1
-    phase = np.angle(slc_data)
-    magnitude = np.abs(slc_data)
-    magnitude_log = np.log1p(magnitude)
 
     print("="*20,"Plotting","="*20)
 
+    figs = list()
     # Phase
     if plotphase:
-        fig_phase, ax_phase = plt.subplots(1,1, figsize=(10,8))
+        phase = bands['phase']
+        fig_phase, ax_phase = plt.subplots(1,1, figsize=FIGSIZE)
         cax_phase = ax_phase.imshow(phase, cmap="hsv", vmin=-np.pi, vmax=np.pi, aspect="auto")
         ax_phase.set_title(f'Phase: {slcstem}')
         ax_phase.set_ylabel('Range')
         ax_phase.set_xlabel('Azimuth')
         fig_phase.colorbar(cax_phase, ax=ax_phase, label='rad')
         fig_phase.savefig(f'{phasefilename}')
+        figs.append(fig_phase)
         print(f'Phase plot save as: {phasefilename}')
 
     # Magnitude
     if plotmagn:
-        fig_mag, ax_mag = plt.subplots(1,1, figsize=(10,8))
+        magnitude_log = bands['magnitude']
+        fig_mag, ax_mag = plt.subplots(1,1, figsize=FIGSIZE)
         vmin, vmax = np.percentile(magnitude_log, [1, 99])  # Clip 1st and 99th percentile
         cax_mag = ax_mag.imshow(magnitude_log, cmap="gray", aspect="auto", vmin=vmin, vmax=vmax)
         ax_mag.set_title(f'Magnitude: {slcstem}')
@@ -163,25 +176,26 @@ def plot_slc(slcfile:Path, prmfile:Path, savedir:Path, bands: list, showflag=Fal
         ax_mag.set_xlabel('Azimuth')
         fig_mag.colorbar(cax_mag, ax=ax_mag)
         fig_mag.savefig(f'{magnitudefilename}')
+        figs.append(fig_mag)
         print(f'Magnitude plot save as: {magnitudefilename}')
 
     # Normalized Magnitude
     if plotnormmag:
-        norm_magnitude = magnitude / magnitude.max()  # Scale between 0 and 1
-        norm_magnitude_log = np.log1p(norm_magnitude * 1000)  # Scale to improve visibility
-        fig_nmag, ax_nmag = plt.subplots(1,1, figsize=(10,8))
+        norm_magnitude_log = bands['normmagnitude']
+        fig_nmag, ax_nmag = plt.subplots(1,1, figsize=FIGSIZE)
         cax_nmag = ax_nmag.imshow(norm_magnitude_log, cmap="gray", aspect="auto")
         ax_nmag.set_title(f'Normalized Magnitude: {slcstem}')
         ax_nmag.set_ylabel('Range')
         ax_nmag.set_xlabel('Azimuth')
         fig_nmag.colorbar(cax_nmag, ax=ax_nmag)
         fig_nmag.savefig(f'{normalizedmagfilename}')
+        figs.append(fig_nmag)
         print(f'Normalized magnitude plot save as: {normalizedmagfilename}\n')
 
     if showflag:
         plt.show()
-    else:
-        plt.close()
+    for fig in figs:
+        plt.close(fig)
 
     return 0
     
@@ -191,12 +205,64 @@ def plot_slc(slcfile:Path, prmfile:Path, savedir:Path, bands: list, showflag=Fal
     #fig.suptitle(f'Cumulative displacements')
 
 
+def slc_bands(slcfile: Path, prmfile: Path, plotphase=True, plotmagn=True, plotnormmag=True, fullres=False) -> dict:
+    """
+    Computes only the requested bands from SLC values as stored (no scale, zeros kept):
+    phase, magnitude (log1p) and normmagnitude (log1p of magnitude normalized to 1000).
+    Full resolution SLC is decoded in blocks of rows straight into float32 phase and magnitude arrays,
+    otherwise the coarsest overview level that fits the figure is used. Logs are applied in place
+    """
+    needmag = plotmagn or plotnormmag
+    if fullres:
+        nlines, rgbins = open_slc(slcfile, prmfile).shape[:2]
+        phase = np.empty((nlines, rgbins), dtype=np.float32) if plotphase else None
+        magnitude = np.empty((nlines, rgbins), dtype=np.float32) if needmag else None
+        for r0, r1, block in iter_slc_blocks(slcfile, prmfile, scale=1, fixzeros=False):
+            if plotphase:
+                np.arctan2(block.imag, block.real, out=phase[r0:r1])
+            if needmag:
+                np.abs(block, out=magnitude[r0:r1])
+    else:
+        dpi = plt.rcParams['figure.dpi']
+        target = (int(FIGSIZE[1] * dpi), int(FIGSIZE[0] * dpi))
+        slc_data, power, factor = read_slc_overview(slcfile, prmfile, target, scale=1, fixzeros=False)
+        if factor > 1:
+            print(f'Using {factor}x overview')
+        phase = np.angle(slc_data) if plotphase else None
+        magnitude = np.sqrt(power, out=power) if needmag else None
+
+    bands = dict()
+    if plotphase:
+        bands['phase'] = phase
+    if plotnormmag:
+        # Scale between 0 and 1, then to 1000 to improve visibility
+        normscale = np.float32(1000 / magnitude.max())
+        norm_magnitude = magnitude * normscale if plotmagn else np.multiply(magnitude, normscale, out=magnitude)
+        bands['normmagnitude'] = np.log1p(norm_magnitude, out=norm_magnitude)
+    if plotmagn:
+        bands['magnitude'] = np.log1p(magnitude, out=magnitude)
+    return bands
+
+
+def _plot_worker(slcfile: Path, savedir: Path, bands: list, overwriteflag=False, fullres=False):
+    try:
+        return plot_slc(slcfile, slcfile.with_suffix('.PRM'), savedir, bands, False, overwriteflag, fullres)
+    except Exception as e:
+        print(f'Exception plotting SLC: {slcfile}\nException: {e}')
+        return -1
+
+
+def _init_worker():
+    matplotlib.use('Agg', force=True)
+
+
 def get_args():
     mess = "Plots Magnitude, Normalize Magnitude and Phase from SLCs in directory. Each SLC must have a PRM file, optionally to plot one single SLC"
 
     example = """EXAMPLE:
        plot_slc.py -d path/to/directory --savedir /path/to/save
        plot_slc.py -f path/to/file --savedir /path/to/save 
+       plot_slc.py -d path/to/directory --savedir /path/to/save --band magnitude --jobs 8
         """
 
     parser = argparse.ArgumentParser(description=mess, epilog=example,
@@ -209,6 +275,8 @@ def get_args():
     parser.add_argument('-s', '--savedir', type=Path, dest='savedir', help='Path to directory to save figures')
     parser.add_argument('--showflag', action='store_true', default=False, help='show flag')
     parser.add_argument('--band', dest='band', choices=['phase', 'magnitude', 'normmagnitude'], default=None, help='Choose what to plot, choices: phase, magnitude, normmagnitude. By default it plots the 3 f them')
+    parser.add_argument('--fullres', dest='fullres', action='store_true', default=False, help='Plot full resolution SLC instead of multilooked overview')
+    parser.add_argument('--jobs', dest='jobs', type=int, default=1, help='Number of SLCs plotted in parallel (off screen). Default: 1')
     parser.add_argument('--ow', dest='overwrite', action='store_true', default=False, help='If set overwrites plots, default False')
     return parser.parse_args()
 
@@ -7,14 +7,21 @@ import matplotlib.pyplot as plt
 from netCDF4 import Dataset as NetCDFFile
 import numpy as np
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from gmtsar_tools.utils import read_grd_overview, axes_pixels
 import pdb
 
+# Panels: grid name, title, cmap
+PANELS = [('phase.grd', 'Phase', 'jet'), ('phasefilt.grd', 'Filtered phase', 'jet'), ('corr.grd', 'Coherence', 'gist_gray')]
+
 
 def main():
     args = get_args()
     intfdir = args.intfdir
     projdir = args.projdir
     flagcont = args.flagcont
+    fullres = args.fullres
+    prefetch = args.prefetch
 
     select_intf = projdir.joinpath('intf_selected')
     reject_intf = projdir.joinpath('intf_rejected')
@@ -37,54 +44,119 @@ def main():
     else:
         reject_intf.mkdir()
 
-    for intf in sorted(intfdir.iterdir()):
-        if intf.is_dir() and "_" in intf.name:
-            phase = intf.joinpath("phase.grd")
-            corr = intf.joinpath("corr.grd")
-            phasef = intf.joinpath("phasefilt.grd")
-
-            fig, (ax1, ax2, ax3) = plt.subplots(1,3, figsize=(11,5), sharey=True, constrained_layout=True)
-            fig.suptitle(f'{intf.name}')
-            # Phase
-            z, extent = opengrd(phase)
-            ax1.imshow(z, extent=extent, cmap='jet', aspect=0.2, interpolation='nearest')
-            ax1.set_title('Phase')
-            ax1.set_xlabel('x')
-            ax1.set_ylabel('y')
-            del z
-            del extent
-            # Phasefilt
-            z, extent = opengrd(phasef)
-            ax2.imshow(z, extent=extent, cmap='jet', aspect=0.2, interpolation='nearest')
-            ax2.set_title('Filtered phase')
-            ax2.set_xlabel('x')
-            del z
-            del extent
-            # Coherence
-            z, extent = opengrd(corr)
-            ax3.imshow(z, extent=extent, cmap='gist_gray', aspect=0.2, interpolation='nearest')
-            ax3.set_title('Coherence')
-            ax3.set_xlabel('x')
-            del z
-            del extent
-            
-            plt.show()
-
-            select = input('select interferogram? (Yes(y)/No(x))')
+    intfs = [intf for intf in sorted(intfdir.iterdir()) if intf.is_dir() and "_" in intf.name]
+    print(f'Num of interferograms to review: {len(intfs)}')
+
+    plt.ion()
+    # q answers the review instead of closing the figure
+    plt.rcParams['keymap.quit'] = [x for x in plt.rcParams['keymap.quit'] if x != 'q']
+    review = ReviewFigure()
+    target = None if fullres else review.target()
+    # Grids of next interferograms are read (and decimated) in background while the current one is reviewed
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        futures = dict()
+        for i, intf in enumerate(intfs):
+            for j in range(i, min(i + 1 + prefetch, len(intfs))):
+                if j not in futures:
+                    futures[j] = pool.submit(load_intf, intfs[j], target)
+
+            grids = futures.pop(i).result()
+            review.show(intf.name, grids)
+
+            select = review.ask('select interferogram? (Yes(y)/No(x)/Quit(q))')
             if select.lower() == 'y':                
                 intf_select = select_intf.joinpath(intf.name)
                 intf.rename(intf_select)
                 print(f'Interferogram {intf.name} selected.\nMoved to {intf_select}')
             elif select.lower() == 'q':
-                exit()
+                for future in futures.values():
+                    future.cancel()
+                break
             else:
                 intf_discard = reject_intf.joinpath(intf.name)
                 intf.rename(intf_discard)
                 print(f'Interferogram {intf.name} NOT selected\nMove to {intf_discard}')
 
+    plt.close(review.fig)
     return 0
 
-def opengrd(path: Path):
+
+class ReviewFigure:
+    """
+    Single 3 panel figure reused for all interferograms, images are updated with set_data.
+    Answers are keys pressed on the figure, the GUI event loop keeps running (zoom, pan) while waiting.
+    A new figure is created if the window was closed
+    """
+    KEYS = ('y', 'x', 'q')
+
+    def __init__(self):
+        self.fig = None
+        self.images = None
+        self.answer = None
+        self.new()
+
+    def new(self):
+        self.fig, self.axes = plt.subplots(1,3, figsize=(11,5), sharey=True, constrained_layout=True)
+        self.images = None
+        for ax, (_, title, _) in zip(self.axes, PANELS):
+            ax.set_title(title)
+            ax.set_xlabel('x')
+        self.axes[0].set_ylabel('y')
+        self.fig.canvas.mpl_connect('key_press_event', self.on_key)
+        self.fig.canvas.mpl_connect('close_event', lambda event: self.fig.canvas.stop_event_loop())
+
+    def on_key(self, event):
+        if event.key in self.KEYS:
+            self.answer = event.key
+            self.fig.canvas.stop_event_loop()
+
+    def ask(self, message):
+        """
+        Waits for y, x or q pressed on the figure. Falls back to terminal input when the window was closed
+        or the backend is not interactive
+        """
+        interactive = self.fig.canvas.required_interactive_framework is not None
+        if interactive and plt.fignum_exists(self.fig.number):
+            print(f'{message} Press key on figure')
+            self.answer = None
+            self.fig.canvas.start_event_loop(timeout=-1)
+            if self.answer is not None:
+                return self.answer
+        return input(message)
+
+    def target(self):
+        return axes_pixels(self.axes[0])
+
+    def show(self, name, grids):
+        if not plt.fignum_exists(self.fig.number):
+            self.new()
+        self.fig.suptitle(name)
+        if self.images is None:
+            self.images = [ax.imshow(z, extent=extent, cmap=cmap, aspect=0.2, interpolation='nearest')
+                           for ax, (z, extent), (_, _, cmap) in zip(self.axes, grids, PANELS)]
+        else:
+            for im, (z, extent) in zip(self.images, grids):
+                im.set_data(z)
+                im.set_extent(extent)
+                im.autoscale()
+        self.fig.canvas.draw_idle()
+        plt.pause(0.001)
+
+
+def load_intf(intf: Path, target=None):
+    """
+    [(z, extent)] of the grids in PANELS of interferogram directory
+    """
+    return [opengrd(intf.joinpath(name), target) for name, _, _ in PANELS]
+
+
+def opengrd(path: Path, target=None):
+    """
+    Returns z and extent of grd, from the coarsest overview level fitting target (rows, cols) pixels if given
+    """
+    if target is not None:
+        z, extent, _ = read_grd_overview(path, target)
+        return z, extent
     nc = NetCDFFile(path.as_posix())
     x = nc.variables['x'][:]
     y = nc.variables['y'][:]
@@ -106,6 +178,8 @@ def get_args():
     # Required arguments
     parser.add_argument('-d', '--intfdir', dest='intfdir', required=True, type=Path, help='Path to directory interferograms: intf')
     parser.add_argument('-p', '--projdir', dest='projdir', required=True, type=Path, help='Path to project directory')
+    parser.add_argument('--fullres', dest='fullres', default=False, action='store_true', help='Plot full resolution grids instead of multilooked overviews')
+    parser.add_argument('--prefetch', dest='prefetch', type=int, default=2, help='Number of next interferograms loaded in background. Default: 2')
     parser.add_argument('--cont', dest='flagcont', default=False, action='store_true', help='Continue the selection')
     return parser.parse_args()
 
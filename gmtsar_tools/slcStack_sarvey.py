@@ -1,213 +1,264 @@
 #!/usr/bin/env python
-import os
 import argparse
 from pathlib import Path
-import glob
-from gmtsar_tools.utils import grep, fracyear2yyyymmdd, try_command, getSlcData, readOldGMTFormat, headingFromLED
+from gmtsar_tools.utils import try_command, getSlcData, readOldGMTFormat, open_slc, decode_slc, calc_baselines, Catalog
+from gmtsar_tools.utils.metadata import get_metadata
 import numpy as np
 import shutil
 import h5py as h5
-import subprocess
-from mintpy.utils import readfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 import pdb
 
+# Chunk tile (rows, cols) of slc dataset, one date per chunk
+SLC_CHUNK = (512, 512)
+
 def main():
     args = get_args()
     slcpath = args.slcpath
     topopath = args.topopath
     skipdates = list() if args.skipdates is None else args.skipdates
     nocorrectflag = args.nocorrectflag
+    workers = args.workers
+    appendflag = args.appendflag
+    catalogpath = args.catalog
     slcpath = slcpath.resolve()
     topopath = topopath.resolve()
 
-    slcs = sorted(glob.glob(f'{str(slcpath)}/*.SLC'))
-    leds = sorted(glob.glob(f'{str(slcpath)}/*.LED'))
-    prms = sorted(glob.glob(f'{str(slcpath)}/*.PRM'))
+    # Acquisitions from project catalog, PRMs are only parsed when new or changed
+    with Catalog(catalogpath if catalogpath else slcpath.parent) as catalog:
+        catalog.refresh_acquisitions(slcpath)
+        acquisitions = catalog.acquisitions(slcpath)
 
-    if len(slcs) != len(leds) != len(prms):
-        raise Exception(f"Inconsistent number of SLCs: {len(slcs)}, LEDs: {len(leds)}, and PRMs: {len(prms)} files")
+    missing = [x['stem'] for x in acquisitions if x['slc_size'] is None or x['led_size'] is None]
+    if not acquisitions or missing:
+        raise Exception(f"Inconsistent SLC, LED and PRM files in {slcpath}. PRMs: {len(acquisitions)}, without SLC or LED: {', '.join(missing)}")
 
     # topo rad
     toporapath = topopath.joinpath("topo_ra.grd")
 
-    # Making the oldest date as reference
-    prmReference = sorted([str(x) for x in slcpath.iterdir() if x.suffix == '.PRM'], key=lambda x: float(grep(x, 'SC_clock_start')))[0]
-    prmRefstartstr = fracyear2yyyymmdd(float(grep(prmReference, 'SC_clock_start'))).strftime("%Y%m%d")
-    slcReference = prmReference.split(".")[0]+".SLC"
-    ledReference = prmReference.split(".")[0]+".LED"
+    # Making the oldest date as reference, acquisitions are sorted by SC_clock_start
+    acqfiles = [(x['prm'], f"{x['directory']}/{x['stem']}.SLC", f"{x['directory']}/{x['led_file']}", x['date']) for x in acquisitions]
+    prmReference, slcReference, ledReference, prmRefstartstr = acqfiles[0]
     slcRef = getSlcData(slcReference, prmReference)
 
-    # create intf directory
-    ifgsPath = Path("smaster_ifgs")
-    if not ifgsPath.exists():
-        ifgsPath.mkdir()
-
-    # Lists of data
-    slcs_noDrho = [slcRef]
-    slcs_raw = [slcRef]
-    bperps = [0]
-    dates = [prmRefstartstr]
+    # Secondary dates to process
+    secondaries = [x for x in acqfiles[1:] if x[3] not in skipdates]
 
     # Metadata
-    meta = get_metadata(topopath)
-
-    for prm, slc, led in zip(prms, slcs, leds):
-        current_cwd = Path().cwd()
-        if prm == prmReference:            
-            continue
-
-        sc_clock_start = float(grep(prm, 'SC_clock_start'))
-        startstr = fracyear2yyyymmdd(sc_clock_start).strftime("%Y%m%d")
+    meta = get_metadata(topopath, 'timeseries')
 
-        if startstr in skipdates:
-            continue
-
-        intfstr = f'{prmRefstartstr}_{startstr}'
-
-        # creates folders
-        ifgPath = ifgsPath.joinpath(intfstr)
-        if not ifgPath.exists():
-            ifgPath.mkdir()
+    # slc stacks are preallocated and each date is written as soon as it is corrected.
+    # Without topo-earth removal the same decoded secondary blocks go to slcStack_topoearth.h5
+    outfnames = ['slcStack.h5']
+    if nocorrectflag:
+        outfnames.append('slcStack_topoearth.h5')
+
+    with ExitStack() as files:
+        if appendflag:
+            # Only dates missing in the existing stacks are processed
+            dsts = [files.enter_context(h5.File(outfname, 'r+')) for outfname in outfnames]
+            stackdates = [read_stack_dates(dst, outfname, prmRefstartstr, slcRef.shape, meta) for outfname, dst in zip(outfnames, dsts)]
+            if any(x != stackdates[0] for x in stackdates):
+                raise Exception(f'Dates in {", ".join(outfnames)} do not match. Please rebuild the stacks')
+            stackdates = stackdates[0]
+            secondaries = [x for x in secondaries if x[3] not in stackdates]
+            if not secondaries:
+                print(f'No new dates to append to {", ".join(outfnames)}')
+                return 0
+            if secondaries[0][3] <= stackdates[-1]:
+                raise Exception(f'New date: {secondaries[0][3]} is older than last date in stack: {stackdates[-1]}. Please rebuild the stack')
+            offset = len(stackdates)
+            nDates = offset + len(secondaries)
+            print(f'Appending {len(secondaries)} dates to SLC stack with {offset} dates')
+            for outfname, dst in zip(outfnames, dsts):
+                resize_stack(dst, outfname, nDates)
         else:
-            print(f'Ifg folder: {ifgPath.as_posix()} exists')
-        # symlinks: PRM, SLC, LED, topo_ra
-        ifgPath.resolve().joinpath(prm.split("/")[-1]).symlink_to(prm)
-        ifgPath.resolve().joinpath(slc.split("/")[-1]).symlink_to(slc)
-        ifgPath.resolve().joinpath(led.split("/")[-1]).symlink_to(led)
-        ifgPath.resolve().joinpath(toporapath.name).symlink_to(toporapath.as_posix())
-        ifgPath.resolve().joinpath(prmReference.split("/")[-1]).symlink_to(prmReference)
-        ifgPath.resolve().joinpath(slcReference.split("/")[-1]).symlink_to(slcReference)
-        ifgPath.resolve().joinpath(ledReference.split("/")[-1]).symlink_to(ledReference)
-
-        # go to ifg directory
-        os.chdir(ifgPath)
-
-        cmd_lst = ["intf.csh", prmReference.split("/")[-1], prm.split("/")[-1], "-topo", str(toporapath)]
-        if not try_command(cmd_lst):
-            raise  Exception(f"Problem running intf.csh in: {ifgsPath}")
-
-        # Perp baseline while I am in ifgPath directory
-        sat_output = subprocess.run(['SAT_baseline', prmReference, prm], capture_output=True, text=True)
-        bperp_grep = subprocess.run(['grep', 'B_perpendicular'], input=sat_output.stdout, capture_output=True, text=True)
-        bperps.append(float(bperp_grep.stdout.split("=")[-1].strip()))
-
-        # go back in directory
-        os.chdir(str(current_cwd))
-
-        # making interferogram between reference and secondary SLCs
-        slcSec = getSlcData(slc, prm)
-        ifg = slcRef * np.conjugate(slcSec)
-
-        # Read real and imaginary part of interferogram formed from GMTSAR using intf.csh
-        realPath = ifgPath.joinpath("real.grd")
-        imagPath = ifgPath.joinpath("imag.grd")
-        real, _ =  readOldGMTFormat(realPath)
-        imag, _ =  readOldGMTFormat(imagPath)
-        ifgNoDrho = real+1j*imag
-        ifgNoDrho = ifgNoDrho/np.abs(ifgNoDrho) # normalizing to not affect the amplitude
-
-        # Ifg with and without topo phase
-        drho = ifg * np.conjugate(ifgNoDrho)
-        drho = drho / np.abs(drho)
-        slcNoDrho = slcSec * drho # adding drho correction
-        slcs_noDrho.append(slcNoDrho)
-
-        # no corrected slcs
-        if nocorrectflag:
-            slcs_raw.append(slcSec)
-
-        # dates
-        dates.append(startstr)
-
-    # slc stack
-    slcStack = np.stack(slcs_noDrho)
-    bperpStack = np.array(bperps, dtype=np.float32)
-    datesStack = np.array(dates, dtype=np.bytes_)
-    outfname = 'slcStack.h5'
-
-    # writing corrected SLCs to h5file
-    print(f'Writing SLC stack')
-    with h5.File(outfname, 'w') as dst:
-        # slc
-        print(f'Writing SLCs...')
-        dst.create_dataset("slc", data=slcStack, dtype=slcStack.dtype, shape=slcStack.shape, chunks=True)
-        # Bperp
-        print(f'Writing perpendicular baseline...')
-        dst.create_dataset("bperp", data=bperpStack, dtype=bperpStack.dtype, shape=bperpStack.shape)       
-        # date
-        print(f'Writing dates...')
-        dst.create_dataset("date", data=datesStack)
+            offset = 1
+            nDates = len(secondaries) + 1
+            print(f'Writing SLC stack with {nDates} dates')
+            dsts = [files.enter_context(h5.File(outfname, 'w')) for outfname in outfnames]
+            for dst in dsts:
+                create_stack(dst, (nDates, *slcRef.shape))
+                dst['slc'][0] = slcRef
+                dst['bperp'][0] = 0
+                dst['date'][0] = np.bytes_(prmRefstartstr)
+
+        slcDset = dsts[0]['slc']
+        rawDset = dsts[1]['slc'] if nocorrectflag else None
+        buffers = alloc_buffers(SLC_CHUNK[0], slcRef.shape[1])
+
+        # create intf directory
+        ifgsPath = Path("smaster_ifgs").resolve()
+        if not ifgsPath.exists():
+            ifgsPath.mkdir()
+
+        # Perpendicular baselines of all new dates in one go
+        bperps, _ = calc_baselines([prmReference] * len(secondaries), [x[0] for x in secondaries])
+
+        # GMTSAR steps run in a process pool, results are consumed in date order
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = list()
+            for prm, slc, led, startstr in secondaries:
+                ifgPath = ifgsPath.joinpath(f'{prmRefstartstr}_{startstr}')
+                futures.append(pool.submit(make_intf, ifgPath, prmReference, slcReference, ledReference,
+                                           prm, slc, led, toporapath))
+
+            # Dates in the stacks that are completely written
+            written = offset
+            try:
+                for ix, ((prm, slc, led, startstr), future, bperp) in enumerate(zip(secondaries, futures, bperps), start=offset):
+                    ifgPath = future.result()
+                    print(f'Correcting date: {startstr} ({ix}/{nDates - 1})')
+
+                    correct_date(slcRef, slc, prm, ifgPath, slcDset, ix, buffers, rawDset=rawDset)
+
+                    # Bperp and date
+                    for dst in dsts:
+                        dst['bperp'][ix] = bperp
+                        dst['date'][ix] = np.bytes_(startstr)
+                    written = ix + 1
+            except BaseException:
+                # do not start GMTSAR on remaining dates if one date fails
+                pool.shutdown(wait=False, cancel_futures=True)
+                # stacks keep only written dates, so they can be extended later with --append
+                print(f'Stopped at date {written}/{nDates - 1}, shrinking {", ".join(outfnames)} to {written} dates')
+                for outfname, dst in zip(outfnames, dsts):
+                    resize_stack(dst, outfname, written)
+                raise
+
         # Metadata
         print(f'Writing Metadata...')
-        for key in meta.keys():
-            dst.attrs[key] = meta[key]
+        for dst in dsts:
+            for key in meta.keys():
+                dst.attrs[key] = meta[key]
 
-    print(f'{outfname} written.')
+    print(f'{", ".join(outfnames)} written.')
 
     # removing single master intfs
     print("Removing intf directory...")
     if ifgsPath.is_dir():
         shutil.rmtree(ifgsPath)
 
-    # writing non corrected slcs if flag is true
-    if nocorrectflag:
-        outfname = 'slcStack_topoearth.h5'
-        slcStack_raw = np.stack(slcs_raw)
-        print(f'Creating slc stack without removing topo-earth component')
-        with h5.File(outfname, 'w') as dst:
-            # slc
-            print(f'Writing SLCs...')
-            dst.create_dataset("slc", data=slcStack_raw, dtype=slcStack_raw.dtype, shape=slcStack_raw.shape, chunks=True)
-            # Bperp
-            print(f'Writing perpendicular baseline...')
-            dst.create_dataset("bperp", data=bperpStack, dtype=bperpStack.dtype, shape=bperpStack.shape)
-            # date
-            print(f'Writing dates...')
-            dst.create_dataset("date", data=datesStack)
-            # Metadata
-            print(f'Writing Metadata...')
-            for key in meta.keys():
-                dst.attrs[key] = meta[key]
-        print(f'{outfname} written.')
-
-
-def get_metadata(topopath: Path):
-    # Check master PRM
-    masterPRM = topopath.joinpath('master.PRM')
-    if not masterPRM.exists():
-        raise Exception('master.PRM seems not to exist. Please check')
-    # Read and add parameters to meta
-    meta = readfile.read_gmtsar_prm(masterPRM)
-
-    # Check if LED is in folder
-    grepOut = subprocess.run(['grep', 'led_file', masterPRM.as_posix()], capture_output=True, text=True)
-    LEDfile = topopath.joinpath(grepOut.stdout.split("=")[1].strip())
-    if not LEDfile.exists():
-        raise Exception('Seems that LED file does not exist. Please check')
-    meta['HEADING'] = headingFromLED(LEDfile)
-
-    # Getting info from topo, inc and slantrange grd files
-    topoInfo = subprocess.run(['gmt', 'grdinfo',  topopath.joinpath('topo_ra_full.grd').as_posix(), '-C'], capture_output=True, text=True)
-    meta['XMIN'] = topoInfo.stdout.split("\t")[1]
-    meta['XMAX'] = topoInfo.stdout.split("\t")[2]
-    meta['YMIN'] = topoInfo.stdout.split("\t")[3]
-    meta['YMAX'] = topoInfo.stdout.split("\t")[4]
-    meta['ALOOKS'] = topoInfo.stdout.split("\t")[7] #xinc
-    meta['RLOOKS'] = topoInfo.stdout.split("\t")[8] #yinc
-    meta['WIDTH'] = topoInfo.stdout.split("\t")[9]
-    meta['LENGTH'] = topoInfo.stdout.split("\t")[10]
-    incInfo = subprocess.run(['gmt', 'grdinfo',  topopath.joinpath('incidence.grd').as_posix(), '-C', '-L2'], capture_output=True, text=True)
-    incMean = float(incInfo.stdout.split("\t")[11])
-    slantInfo = subprocess.run(['gmt', 'grdinfo',  topopath.joinpath('slantRange.grd').as_posix(), '-C', '-L2'], capture_output=True, text=True)
-    slantMean = float(slantInfo.stdout.split("\t")[11])
-    grepOut = subprocess.run(['grep', 'led_file', masterPRM.as_posix()], capture_output=True, text=True)
-    LEDfile = grepOut.stdout.split("=")[1].strip()
-    meta['FILE_TYPE'] = 'timeseries'
-    meta['AZIMUTH_PIXEL_SIZE'] *= int(meta['ALOOKS'])
-    meta['RANGE_PIXEL_SIZE'] *= int(meta['RLOOKS'])
-    meta['UNIT'] = 'i'
-    meta = readfile.standardize_metadata(meta)
-    return meta
+
+def make_intf(ifgPath: Path, prmReference, slcReference, ledReference, prm, slc, led, toporapath: Path):
+    """
+    Runs intf.csh for one secondary inside its own ifgPath folder.
+    The command gets ifgPath as working directory, so the caller's cwd is never changed and
+    several dates can run at the same time. Returns ifgPath
+    """
+    # creates folders
+    if not ifgPath.exists():
+        ifgPath.mkdir()
+    else:
+        print(f'Ifg folder: {ifgPath.as_posix()} exists')
+    # symlinks: PRM, SLC, LED, topo_ra
+    for src in [prm, slc, led, toporapath.as_posix(), prmReference, slcReference, ledReference]:
+        link = ifgPath.joinpath(src.split("/")[-1])
+        if not link.is_symlink():
+            link.symlink_to(src)
+
+    cmd_lst = ["intf.csh", prmReference.split("/")[-1], prm.split("/")[-1], "-topo", str(toporapath)]
+    if not try_command(cmd_lst, cwd=ifgPath):
+        raise  Exception(f"Problem running intf.csh in: {ifgPath}")
+
+    return ifgPath
+
+
+def alloc_buffers(blockrows, cols):
+    """
+    Work buffers for correct_date: decoded secondary, output, temporary complex64 and float32 block
+    """
+    return (np.empty((blockrows, cols), dtype=np.complex64), np.empty((blockrows, cols), dtype=np.complex64),
+            np.empty((blockrows, cols), dtype=np.complex64), np.empty((blockrows, cols), dtype=np.float32))
+
+
+def drho_correction(ref, sec, real, imag, out, tmp, absbuf):
+    """
+    Removes topo-earth phase from secondary block: out = sec * drho/|drho| with
+    drho = ref*conj(sec) * conj(real + 1j*imag), where real and imag are the GMTSAR
+    interferogram without topo-earth phase. Everything is computed in place in complex64.
+    Normalizing the GMTSAR interferogram is skipped since drho gets normalized anyway
+    """
+    np.conjugate(sec, out=out)
+    np.multiply(ref, out, out=out)     # ifg
+    tmp.real = real
+    np.negative(imag, out=tmp.imag)    # conj(ifgNoDrho)
+    np.multiply(out, tmp, out=out)     # drho
+    np.abs(out, out=absbuf)
+    np.divide(out, absbuf, out=out)
+    np.multiply(out, sec, out=out)     # slcNoDrho
+    return out
+
+
+def correct_date(slcRef, slc, prm, ifgPath: Path, slcDset, ix, buffers, rawDset=None):
+    """
+    Corrects secondary slc in row blocks and writes it into slcDset[ix].
+    If rawDset is given the uncorrected blocks are written into rawDset[ix] in the same pass
+    """
+    secBuf, outBuf, tmpBuf, absBuf = buffers
+    blockrows = secBuf.shape[0]
+    slcSec = open_slc(slc, prm)
+    # Read real and imaginary part of interferogram formed from GMTSAR using intf.csh
+    real, _ = readOldGMTFormat(ifgPath.joinpath("real.grd"), mmap=True)
+    imag, _ = readOldGMTFormat(ifgPath.joinpath("imag.grd"), mmap=True)
+    if real.shape != slcRef.shape or imag.shape != slcRef.shape:
+        raise Exception(f'Dimensions of real/imag.grd in {ifgPath}: {real.shape} do not match SLC dimensions: {slcRef.shape}')
+
+    for r0 in range(0, slcRef.shape[0], blockrows):
+        r1 = min(r0 + blockrows, slcRef.shape[0])
+        n = r1 - r0
+        sec = decode_slc(slcSec[r0:r1], out=secBuf[:n])
+        if rawDset is not None:
+            rawDset[ix, r0:r1] = sec
+        slcDset[ix, r0:r1] = drho_correction(slcRef[r0:r1], sec, real[r0:r1], imag[r0:r1],
+                                             outBuf[:n], tmpBuf[:n], absBuf[:n])
+
+
+def create_stack(dst, shape, chunkrows=SLC_CHUNK[0], chunkcols=SLC_CHUNK[1]):
+    """
+    Preallocates complex64 slc dataset (dates, rows, cols), bperp and date. Chunks hold one date and a
+    chunkrows x chunkcols tile, so writing one date only touches its own chunks.
+    Datasets are resizable along dates so new acquisitions can be appended later
+    """
+    nDates, rows, cols = shape
+    chunks = (1, min(rows, chunkrows), min(cols, chunkcols))
+    dst.create_dataset("slc", shape=shape, maxshape=(None, rows, cols), dtype=np.complex64, chunks=chunks)
+    dst.create_dataset("bperp", shape=(nDates,), maxshape=(None,), dtype=np.float32)
+    dst.create_dataset("date", shape=(nDates,), maxshape=(None,), dtype='S8')
+
+
+# Metadata that has to match to append dates to an existing stack
+APPEND_META_KEYS = ['LENGTH', 'WIDTH', 'XMIN', 'XMAX', 'YMIN', 'YMAX', 'ALOOKS', 'RLOOKS']
+
+def read_stack_dates(dst, outfname, refdate, slcshape, meta) -> list:
+    """
+    Returns dates of existing stack after checking that dates are set and sorted, and that reference date,
+    SLC dimensions and metadata match the current dataset
+    """
+    for dset in ['slc', 'bperp', 'date']:
+        if dset not in dst:
+            raise Exception(f'Dataset: {dset} not found in {outfname}')
+    dates = [x.decode('utf-8') for x in dst['date'][:]]
+    if not dates or dates[0] != refdate:
+        raise Exception(f'Reference date of {outfname}: {dates[0] if dates else None} does not match reference date: {refdate}')
+    if any(not x for x in dates) or any(a >= b for a, b in zip(dates[:-1], dates[1:])):
+        raise Exception(f'Dates of {outfname} are empty or not sorted, stack seems damaged. Please rebuild it\nDates: {dates}')
+    if dst['slc'].shape[1:] != slcshape:
+        raise Exception(f'SLC dimensions of {outfname}: {dst["slc"].shape[1:]} do not match SLC dimensions: {slcshape}')
+    for key in APPEND_META_KEYS:
+        if key in meta and str(dst.attrs.get(key)) != str(meta[key]):
+            raise Exception(f'Metadata {key} of {outfname}: {dst.attrs.get(key)} does not match: {meta[key]}')
+    return dates
+
+
+def resize_stack(dst, outfname, nDates):
+    for dset in ['slc', 'bperp', 'date']:
+        try:
+            dst[dset].resize(nDates, axis=0)
+        except TypeError as e:
+            raise Exception(f'Dataset: {dset} in {outfname} can not be extended, stack was written without append support. '
+                            f'Please rebuild it\nException: {e}')
 
 
 def get_args():
@@ -215,6 +266,8 @@ def get_args():
 
     example = """EXAMPLE:
        slcStack_sarvey.py -s path/to/coregistered_slc -t path/to/topo
+       slcStack_sarvey.py -slc path/to/coregistered_slc -topo path/to/topo --workers 16
+       slcStack_sarvey.py -slc path/to/coregistered_slc -topo path/to/topo --append
         """
 
     parser = argparse.ArgumentParser(description=mess, epilog=example,
@@ -224,6 +277,9 @@ def get_args():
     parser.add_argument('-slc', type=Path, dest='slcpath', required=True, help='Path to coregistered SLC directory')
     parser.add_argument('-topo', type=Path, dest='topopath', required=True, help='Path to topo directory')
     parser.add_argument('--skipdates', dest='skipdates', nargs='*', type=str, help='Dates to skip. e.g. 20150101 20160101')
+    parser.add_argument('--workers', dest='workers', type=int, default=1, help='Number of dates processed in parallel with GMTSAR. Default: 1')
+    parser.add_argument('--append', dest='appendflag', action='store_true', default=False, help='Append only new dates to existing slcStack.h5 (and slcStack_topoearth.h5 with --nocorrect)')
+    parser.add_argument('--catalog', dest='catalog', type=Path, default=None, help='Project catalog (SQLite file or directory). Default: parent of SLC directory')
     parser.add_argument('--nocorrect', dest='nocorrectflag', action='store_true', default=False, help='Flag to skip topo-earth phase removal')
     return parser.parse_args()
 
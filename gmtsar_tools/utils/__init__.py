@@ -1 +1,10 @@
-from .utils import *
\ No newline at end of file
+from .utils import *
+from .prm import PRM, parse_prm, read_prm, read_prms, write_prm
+from .slc import slc_shape, open_slc, decode_slc, read_slc, iter_slc_blocks
+from .baseline import read_led, calc_baselines, get_bperp
+from .validate import check_slc_file, check_slc_dir, write_report
+from .crop import crop_prm, crop_slc
+from .grdinfo import grd_info, grd_mean, gmt_format
+from .network import candidate_pairs, edge_weights, optimize_network
+from .catalog import Catalog
+from .overview import grd_overviews, slc_overviews, read_grd_overview, read_slc_overview, pick_factor, axes_pixels
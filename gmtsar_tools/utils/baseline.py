@@ -0,0 +1,168 @@
+import os
+from datetime import date
+from pathlib import Path
+import numpy as np
+from .prm import read_prm, read_prms
+
+"""
+Perpendicular and parallel baselines computed from LED orbits and PRM timing, without SAT_baseline.
+Baselines are computed at mid scene and mid swath following GMTSAR convention:
+B = sqrt(bh^2 + bv^2), alpha = atan2(bv, bh), Bpar = B sin(theta - alpha), Bperp = B cos(theta - alpha)
+with bh, bv the horizontal (towards look direction) and vertical components of the secondary position minus the
+reference position at closest approach, and theta the look angle.
+"""
+
+SPEED_OF_LIGHT = 299792458.0
+WGS84_A = 6378137.0
+WGS84_B = 6356752.31424518
+NEWTON_ITER = 6
+
+# Parsed LED files: {absolute path: (mtime_ns, size, (t, pos, vel))}
+_led_cache = dict()
+
+
+def _year_ordinals(years):
+    uyears, inverse = np.unique(years, return_inverse=True)
+    ordinals = np.array([date(int(y), 1, 1).toordinal() for y in uyears], dtype=np.float64)
+    return ordinals[inverse]
+
+
+def read_led(ledfile):
+    """
+    Reads LED state vectors. Format (after one header line): year, dayofYear, seconds, X, Y, Z, Vx, Vy, Vz
+    Returns time in seconds (days counted from proleptic ordinal), positions (n,3) and velocities (n,3)
+    """
+    ledfile = os.path.abspath(ledfile)
+    st = os.stat(ledfile)
+    cached = _led_cache.get(ledfile)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+
+    data = np.loadtxt(ledfile, skiprows=1, ndmin=2)
+    if data.shape[0] < 2 or data.shape[1] != 9:
+        raise Exception(f'LED file: {ledfile} needs at least two state vectors with 9 columns')
+    t = (_year_ordinals(data[:, 0]) + data[:, 1] - 1) * 86400 + data[:, 2]
+    orbit = (t, data[:, 3:6], data[:, 6:9])
+    _led_cache[ledfile] = (st.st_mtime_ns, st.st_size, orbit)
+    return orbit
+
+
+def led_from_prm(prmPath) -> Path:
+    """
+    LED file given by led_file in PRM, relative to the PRM directory
+    """
+    prm = read_prm(prmPath)
+    if 'led_file' not in prm:
+        raise Exception(f'led_file not found in PRM file: {prmPath}')
+    ledfile = Path(prmPath).parent.joinpath(str(prm['led_file']))
+    if not ledfile.exists():
+        raise Exception(f'LED file: {ledfile} from PRM: {prmPath} does not exist')
+    return ledfile
+
+
+def prm_time(sc_clock):
+    """
+    SC_clock (yyyyddd.dddd) to seconds in the same time base as read_led
+    """
+    sc_clock = np.asarray(sc_clock, dtype=np.float64)
+    years = (sc_clock // 1000).astype(int)
+    return (_year_ordinals(years) + (sc_clock - years * 1000) - 1) * 86400
+
+
+def interp_orbits(T, P, V, t):
+    """
+    Hermite interpolation of many orbits at once.
+    T: (n, m) state vector times padded with inf, P, V: (n, m, 3) positions and velocities, t: (n,) times
+    Returns positions and velocities (n, 3) at t
+    """
+    nsv = np.isfinite(T).sum(axis=1)
+    rows = np.arange(len(t))
+    i = np.clip((T <= t[:, None]).sum(axis=1) - 1, 0, nsv - 2)
+    t0, t1 = T[rows, i], T[rows, i + 1]
+    h = (t1 - t0)[:, None]
+    s = ((t - t0)[:, None]) / h
+    p0, p1, v0, v1 = P[rows, i], P[rows, i + 1], V[rows, i], V[rows, i + 1]
+    s2, s3 = s * s, s * s * s
+    pos = (2*s3 - 3*s2 + 1)*p0 + (s3 - 2*s2 + s)*h*v0 + (-2*s3 + 3*s2)*p1 + (s3 - s2)*h*v1
+    vel = (6*s2 - 6*s)*(p0 - p1)/h + (3*s2 - 4*s + 1)*v0 + (3*s2 - 2*s)*v1
+    return pos, vel
+
+
+def _stack_orbits(orbits):
+    m = max(len(t) for t, _, _ in orbits)
+    T = np.full((len(orbits), m), np.inf)
+    P = np.zeros((len(orbits), m, 3))
+    V = np.zeros((len(orbits), m, 3))
+    for k, (t, pos, vel) in enumerate(orbits):
+        T[k, :len(t)], P[k, :len(t)], V[k, :len(t)] = t, pos, vel
+    return T, P, V
+
+
+def _rowdot(a, b):
+    return np.einsum('ij,ij->i', a, b)
+
+
+def calc_baselines(refPRMs, secPRMs):
+    """
+    Perpendicular and parallel baselines for pairs (refPRMs[k], secPRMs[k]).
+    Each PRM and LED is read once, all pairs are computed in a single vectorized pass.
+    Returns arrays bperp, bpar in meters
+    """
+    refPRMs, secPRMs = [str(x) for x in refPRMs], [str(x) for x in secPRMs]
+    if len(refPRMs) != len(secPRMs):
+        raise Exception(f'Number of reference PRMs: {len(refPRMs)} and secondary PRMs: {len(secPRMs)} do not match')
+    if not refPRMs:
+        return np.zeros(0), np.zeros(0)
+
+    uprms = list(dict.fromkeys(refPRMs + secPRMs))
+    index = {x: k for k, x in enumerate(uprms)}
+    prms = read_prms(uprms)
+    T, P, V = _stack_orbits([read_led(led_from_prm(x)) for x in uprms])
+
+    # Scene timing and geometry per PRM
+    tmid = prm_time([p['SC_clock_start'] for p in prms]) + np.array([p['num_lines'] / 2 / p['PRF'] for p in prms])
+    rho = np.array([p['near_range'] + p['num_rng_bins'] / 2 * SPEED_OF_LIGHT / (2 * p['rng_samp_rate']) for p in prms])
+    earth_radius = np.array([float(p.get('earth_radius', np.nan)) for p in prms])
+    lookleft = np.array([str(p.get('lookdir', 'R')).upper() == 'L' for p in prms])
+
+    iref = np.array([index[x] for x in refPRMs])
+    isec = np.array([index[x] for x in secPRMs])
+
+    # Reference position at mid scene
+    p1, v1 = interp_orbits(T[iref], P[iref], V[iref], tmid[iref])
+
+    # Closest approach of secondary orbit: (p2 - p1).v2 = 0
+    Ts, Ps, Vs = T[isec], P[isec], V[isec]
+    t2 = tmid[isec].copy()
+    for _ in range(NEWTON_ITER):
+        p2, v2 = interp_orbits(Ts, Ps, Vs, t2)
+        t2 -= _rowdot(p2 - p1, v2) / _rowdot(v2, v2)
+    p2, _ = interp_orbits(Ts, Ps, Vs, t2)
+    b = p2 - p1
+
+    # Local frame at reference: up (orthogonal to velocity) and horizontal cross-track towards look direction
+    vhat = v1 / np.linalg.norm(v1, axis=1)[:, None]
+    up = p1 - _rowdot(p1, vhat)[:, None] * vhat
+    up /= np.linalg.norm(up, axis=1)[:, None]
+    horiz = np.cross(vhat, up)
+    horiz[lookleft[iref]] *= -1
+
+    # Look angle from spherical earth with radius at the target
+    H = np.linalg.norm(p1, axis=1)
+    Re = earth_radius[iref]
+    nolocal = ~np.isfinite(Re)
+    if nolocal.any():
+        coslat2 = (p1[nolocal, 0]**2 + p1[nolocal, 1]**2) / H[nolocal]**2
+        Re[nolocal] = WGS84_A * WGS84_B / np.sqrt(WGS84_B**2 * coslat2 + WGS84_A**2 * (1 - coslat2))
+    r = rho[iref]
+    theta = np.arccos(np.clip((H**2 + r**2 - Re**2) / (2 * H * r), -1, 1))
+
+    bh, bv = _rowdot(b, horiz), _rowdot(b, up)
+    bpar = bh * np.sin(theta) - bv * np.cos(theta)
+    bperp = bh * np.cos(theta) + bv * np.sin(theta)
+    return bperp, bpar
+
+
+def get_bperp(refPRM, secPRM) -> float:
+    bperp, _ = calc_baselines([refPRM], [secPRM])
+    return float(bperp[0])
@@ -0,0 +1,161 @@
+import os
+import json
+import sqlite3
+from pathlib import Path
+from .prm import read_prm, read_prms
+from .utils import fracyear2yyyymmdd
+
+# SQLite catalog kept in project directory
+CATALOG_NAME = '.gmtsar_tools_catalog.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS acquisitions (
+    prm TEXT PRIMARY KEY, directory TEXT, stem TEXT, date TEXT, orbit TEXT,
+    prm_mtime INTEGER, prm_size INTEGER, slc_size INTEGER, led_file TEXT, led_size INTEGER,
+    sc_clock_start REAL, num_lines INTEGER, num_rng_bins INTEGER, prf REAL, near_range REAL, lookdir TEXT
+);
+CREATE INDEX IF NOT EXISTS acquisitions_directory ON acquisitions (directory);
+CREATE TABLE IF NOT EXISTS interferograms (
+    path TEXT PRIMARY KEY, intfdir TEXT, name TEXT, date1 TEXT, date2 TEXT, nprm INTEGER,
+    ref_prm TEXT, sec_prm TEXT, ref_stem TEXT, sec_stem TEXT, ref_orbit TEXT, sec_orbit TEXT,
+    grids TEXT, files TEXT
+);
+CREATE INDEX IF NOT EXISTS interferograms_intfdir ON interferograms (intfdir);
+"""
+
+
+def _orbit(stem: str) -> str:
+    parts = stem.split("_")
+    return parts[-2] if len(parts) > 1 else ''
+
+
+def _scan(directory, suffixes) -> dict:
+    """
+    {name: (mtime_ns, size)} of files in directory ending with suffixes, with one os.scandir
+    """
+    files = dict()
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(suffixes) and entry.is_file():
+                st = entry.stat()
+                files[entry.name] = (st.st_mtime_ns, st.st_size)
+    return files
+
+
+class Catalog:
+    """
+    Catalog of a GMTSAR project stored in SQLite: acquisitions (PRM, SLC and LED of each date) and
+    interferograms (intf directories with their PRMs and grids).
+    Refreshing a directory scans it with os.scandir and only parses entries that changed since last refresh
+    """
+
+    def __init__(self, path):
+        path = Path(path)
+        self.dbpath = path.joinpath(CATALOG_NAME) if path.is_dir() else path
+        self.conn = sqlite3.connect(self.dbpath.as_posix(), timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def refresh_acquisitions(self, directory) -> int:
+        """
+        Updates acquisitions of directory (PRM files with SLC and LED). PRMs are parsed only when new or
+        changed (mtime, size), acquisitions whose PRM disappeared are removed. Returns number of PRMs parsed
+        """
+        directory = Path(directory).resolve().as_posix()
+        files = _scan(directory, ('.PRM', '.SLC', '.LED'))
+        known = {row['prm']: row for row in
+                 self.conn.execute('SELECT prm, prm_mtime, prm_size, led_file FROM acquisitions WHERE directory = ?', (directory,))}
+
+        parsed, sizes, rows = 0, list(), list()
+        for name, (mtime, size) in files.items():
+            if not name.endswith('.PRM'):
+                continue
+            prmpath = f'{directory}/{name}'
+            stem = name[:-len('.PRM')]
+            slc_size = files.get(f'{stem}.SLC', (None, None))[1]
+            row = known.pop(prmpath, None)
+            if row is not None and row['prm_mtime'] == mtime and row['prm_size'] == size:
+                led_size = files.get(row['led_file'], (None, None))[1]
+                sizes.append((slc_size, led_size, prmpath))
+                continue
+            prm = read_prm(prmpath)
+            led_file = str(prm.get('led_file', f'{stem}.LED'))
+            sc_clock = prm.get('SC_clock_start')
+            date = fracyear2yyyymmdd(float(sc_clock)).strftime('%Y%m%d') if sc_clock is not None else None
+            rows.append((prmpath, directory, stem, date, _orbit(stem), mtime, size, slc_size, led_file,
+                         files.get(led_file, (None, None))[1], sc_clock, prm.get('num_lines'), prm.get('num_rng_bins'),
+                         prm.get('PRF'), prm.get('near_range'), prm.get('lookdir')))
+            parsed += 1
+
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO acquisitions VALUES (' + ','.join('?' * 16) + ')', rows)
+            self.conn.executemany('UPDATE acquisitions SET slc_size = ?, led_size = ? WHERE prm = ?', sizes)
+            self.conn.executemany('DELETE FROM acquisitions WHERE prm = ?', [(x,) for x in known])
+        return parsed
+
+    def refresh_intfs(self, intfdir) -> int:
+        """
+        Updates interferograms of intfdir (subdirectories named date1_date2). Each directory is listed with
+        os.scandir and only reprocessed when its PRM or grid files (names, mtimes, sizes) changed.
+        Reference and secondary PRMs are ordered by SC_clock_start. Returns number of directories updated
+        """
+        intfdir = Path(intfdir).resolve().as_posix()
+        with os.scandir(intfdir) as entries:
+            dirs = [entry for entry in entries if entry.is_dir() and len(entry.name.split("_")) == 2]
+        known = {row['path']: row['files'] for row in
+                 self.conn.execute('SELECT path, files FROM interferograms WHERE intfdir = ?', (intfdir,))}
+
+        rows = list()
+        for entry in dirs:
+            files = _scan(entry.path, ('.PRM', '.grd'))
+            signature = json.dumps(sorted(files.items()))
+            if known.pop(entry.path, None) == signature:
+                continue
+            prms = [f'{entry.path}/{x}' for x in files if x.endswith('.PRM')]
+            ref_prm = sec_prm = ref_stem = sec_stem = None
+            if len(prms) == 2:
+                clocks = [float(x.get('SC_clock_start', 0)) for x in read_prms(prms)]
+                ref_prm, sec_prm = [x for _, x in sorted(zip(clocks, prms))]
+                ref_stem, sec_stem = Path(ref_prm).stem, Path(sec_prm).stem
+            date1, date2 = entry.name.split("_")
+            grids = sorted(x for x in files if x.endswith('.grd'))
+            rows.append((entry.path, intfdir, entry.name, date1, date2, len(prms), ref_prm, sec_prm, ref_stem, sec_stem,
+                         _orbit(ref_stem) if ref_stem else None, _orbit(sec_stem) if sec_stem else None,
+                         json.dumps(grids), signature))
+
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO interferograms VALUES (' + ','.join('?' * 14) + ')', rows)
+            self.conn.executemany('DELETE FROM interferograms WHERE path = ?', [(x,) for x in known])
+        return len(rows)
+
+    def acquisitions(self, directory) -> list:
+        """
+        Acquisitions of directory sorted by SC_clock_start, as dictionaries
+        """
+        directory = Path(directory).resolve().as_posix()
+        cur = self.conn.execute('SELECT * FROM acquisitions WHERE directory = ? ORDER BY sc_clock_start, stem', (directory,))
+        return [dict(row) for row in cur]
+
+    def intfs(self, intfdir) -> list:
+        """
+        Interferograms of intfdir sorted by name, as dictionaries. grids is a list of grid names,
+        files a dictionary {name: (mtime_ns, size)} of PRM and grid files
+        """
+        intfdir = Path(intfdir).resolve().as_posix()
+        cur = self.conn.execute('SELECT * FROM interferograms WHERE intfdir = ? ORDER BY name', (intfdir,))
+        intfs = list()
+        for row in cur:
+            row = dict(row)
+            row['grids'] = json.loads(row['grids'])
+            row['files'] = {name: tuple(x) for name, x in json.loads(row['files'])}
+            intfs.append(row)
+        return intfs
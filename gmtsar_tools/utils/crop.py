@@ -0,0 +1,67 @@
+from contextlib import ExitStack
+from pathlib import Path
+import numpy as np
+from .prm import read_prm, write_prm
+from .slc import open_slc
+from .baseline import SPEED_OF_LIGHT
+
+
+def crop_prm(prm: dict, window, slcname: str) -> dict:
+    """
+    Returns PRM dictionary for SLC cropped to window (xmin, xmax, ymin, ymax),
+    range bins xmin:xmax and azimuth lines ymin:ymax
+    """
+    xmin, xmax, ymin, ymax = window
+    nx, ny = xmax - xmin, ymax - ymin
+    new = prm.copy()
+    new['SLC_file'] = slcname
+    new['num_rng_bins'] = nx
+    for key in ['bytes_per_line', 'good_bytes_per_line']:
+        if key in prm:
+            new[key] = nx * 4
+    new['near_range'] = prm['near_range'] + xmin * SPEED_OF_LIGHT / (2 * prm['rng_samp_rate'])
+    new['num_lines'] = ny
+    for key in ['nrows', 'num_valid_az']:
+        if key in prm:
+            new[key] = ny
+    if 'num_patches' in prm:
+        new['num_patches'] = 1
+    # azimuth timing in days
+    for start, stop in [('clock_start', 'clock_stop'), ('SC_clock_start', 'SC_clock_stop')]:
+        if start in prm:
+            new[start] = prm[start] + ymin / prm['PRF'] / 86400
+            if stop in prm:
+                new[stop] = new[start] + ny / prm['PRF'] / 86400
+    return new
+
+
+def crop_slc(slcPath, prmPath, windows: list, outstems: list, blockrows=1024):
+    """
+    Crops SLC and PRM to several windows (xmin, xmax, ymin, ymax) in one sequential read of the source SLC.
+    Window limits follow Python slicing, xmax and ymax are excluded.
+    Each window k is written to outstems[k] + .SLC/.PRM
+    """
+    if len(windows) != len(outstems):
+        raise Exception(f'Number of windows: {len(windows)} and output stems: {len(outstems)} do not match')
+    slc = open_slc(slcPath, prmPath)
+    nlines, rgbins = slc.shape[:2]
+    for xmin, xmax, ymin, ymax in windows:
+        if not (0 <= xmin < xmax <= rgbins and 0 <= ymin < ymax <= nlines):
+            raise Exception(f'Window: {xmin}/{xmax}/{ymin}/{ymax} out of SLC dimensions: nrows {nlines} range bins {rgbins}')
+
+    outstems = [Path(x) for x in outstems]
+    y0 = min(w[2] for w in windows)
+    y1 = max(w[3] for w in windows)
+    with ExitStack() as files:
+        outs = [files.enter_context(open(stem.with_suffix('.SLC'), 'wb')) for stem in outstems]
+        for r0 in range(y0, y1, blockrows):
+            r1 = min(r0 + blockrows, y1)
+            block = np.asarray(slc[r0:r1])
+            for (xmin, xmax, ymin, ymax), f in zip(windows, outs):
+                a, b = max(r0, ymin), min(r1, ymax)
+                if a < b:
+                    np.ascontiguousarray(block[a - r0:b - r0, xmin:xmax]).tofile(f)
+
+    prm = read_prm(prmPath)
+    for window, stem in zip(windows, outstems):
+        write_prm(crop_prm(prm, window, stem.with_suffix('.SLC').name), stem.with_suffix('.PRM'))
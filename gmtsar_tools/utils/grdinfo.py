@@ -0,0 +1,69 @@
+from pathlib import Path
+import numpy as np
+from netCDF4 import Dataset as NetCDFFile
+
+
+def _coord_names(nc):
+    if 'x' in nc.variables and 'y' in nc.variables:
+        return 'x', 'y'
+    elif 'lon' in nc.variables and 'lat' in nc.variables:
+        return 'lon', 'lat'
+    raise Exception(f'Grid: {nc.filepath()} has no x/y or lon/lat variables')
+
+
+def _axis_info(var, n, pixelreg):
+    """
+    Returns (min, max, inc) of a grid axis. Uses actual_range when available, otherwise the
+    first and last coordinates, so the coordinate array is never read in full
+    """
+    if 'actual_range' in var.ncattrs():
+        vmin, vmax = (float(x) for x in var.actual_range)
+        inc = (vmax - vmin) / (n - 1 + pixelreg) if n - 1 + pixelreg > 0 else 0.0
+    else:
+        first, last = float(var[0]), float(var[n - 1])
+        inc = abs(last - first) / (n - 1) if n > 1 else 0.0
+        vmin, vmax = min(first, last) - pixelreg * inc / 2, max(first, last) + pixelreg * inc / 2
+    return vmin, vmax, inc
+
+
+def grd_info(grdPath) -> dict:
+    """
+    Grid extents, increments and dimensions read from NetCDF headers, as `gmt grdinfo -C` gives them:
+    x_min, x_max, y_min, y_max, z_min, z_max, x_inc, y_inc, n_columns, n_rows, registration (0 gridline, 1 pixel).
+    z_min and z_max come from the z actual_range attribute and are None if it is missing
+    """
+    with NetCDFFile(Path(grdPath).as_posix()) as nc:
+        xname, yname = _coord_names(nc)
+        n_rows, n_columns = nc.variables['z'].shape
+        pixelreg = int(getattr(nc, 'node_offset', 0))
+        x_min, x_max, x_inc = _axis_info(nc.variables[xname], n_columns, pixelreg)
+        y_min, y_max, y_inc = _axis_info(nc.variables[yname], n_rows, pixelreg)
+        z = nc.variables['z']
+        z_min, z_max = (float(x) for x in z.actual_range) if 'actual_range' in z.ncattrs() else (None, None)
+
+    return {'x_min': x_min, 'x_max': x_max, 'y_min': y_min, 'y_max': y_max, 'z_min': z_min, 'z_max': z_max,
+            'x_inc': x_inc, 'y_inc': y_inc, 'n_columns': n_columns, 'n_rows': n_rows, 'registration': pixelreg}
+
+
+def grd_mean(grdPath, blockrows=1024) -> float:
+    """
+    Mean of z ignoring NaNs and fill values, streamed in blocks of rows (as `gmt grdinfo -L2`)
+    """
+    total, count = 0.0, 0
+    with NetCDFFile(Path(grdPath).as_posix()) as nc:
+        z = nc.variables['z']
+        for r0 in range(0, z.shape[0], blockrows):
+            block = np.ma.filled(z[r0:r0 + blockrows].astype(np.float64), np.nan)
+            valid = np.isfinite(block)
+            total += block[valid].sum()
+            count += np.count_nonzero(valid)
+    return total / count if count else np.nan
+
+
+def gmt_format(value) -> str:
+    """
+    Formats numbers like GMT default FORMAT_FLOAT_OUT (%.12g)
+    """
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    return f'{value:.12g}'
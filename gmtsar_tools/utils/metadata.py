@@ -0,0 +1,105 @@
+import os
+import json
+from pathlib import Path
+from mintpy.utils import readfile
+from .prm import read_prm
+from .utils import headingFromLED
+from .grdinfo import grd_info, grd_mean, gmt_format
+
+# Sidecar file in topo directory with metadata computed from master.PRM, LED and geometry grids
+META_CACHE = '.gmtsar_tools_meta.json'
+META_GRIDS = ['topo_ra_full.grd', 'incidence.grd', 'slantRange.grd']
+
+
+def _sources_key(paths) -> dict:
+    key = dict()
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            key[Path(path).name] = None
+            continue
+        key[Path(path).name] = [st.st_mtime_ns, st.st_size]
+    return key
+
+
+def topo_metadata(topopath: Path) -> dict:
+    """
+    Metadata shared by SARvey exports: master.PRM parameters (mintpy), heading from LED, extents and
+    looks of topo_ra_full.grd and means of incidence.grd and slantRange.grd.
+    The result is cached in topopath/META_CACHE and reused while mtimes and sizes of
+    master.PRM, the LED and the grids do not change. Missing incidence/slantRange grids are skipped
+    """
+    topopath = Path(topopath)
+    # Check master PRM
+    masterPRM = topopath.joinpath('master.PRM')
+    if not masterPRM.exists():
+        raise Exception('master.PRM seems not to exist. Please check')
+
+    # Check if LED is in folder
+    LEDfile = topopath.joinpath(str(read_prm(masterPRM)['led_file']))
+    if not LEDfile.exists():
+        raise Exception('Seems that LED file does not exist. Please check')
+
+    key = _sources_key([masterPRM, LEDfile] + [topopath.joinpath(x) for x in META_GRIDS])
+    cachefile = topopath.joinpath(META_CACHE)
+    if cachefile.exists():
+        try:
+            with open(cachefile, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = dict()
+        if cache.get('key') == key:
+            print(f'Using cached metadata: {cachefile}')
+            return cache['meta']
+
+    # Read and add parameters to meta
+    meta = readfile.read_gmtsar_prm(masterPRM)
+    meta['HEADING'] = headingFromLED(LEDfile)
+
+    # Getting info from topo, inc and slantrange grd files
+    topoInfo = grd_info(topopath.joinpath('topo_ra_full.grd'))
+    meta['XMIN'] = gmt_format(topoInfo['x_min'])
+    meta['XMAX'] = gmt_format(topoInfo['x_max'])
+    meta['YMIN'] = gmt_format(topoInfo['y_min'])
+    meta['YMAX'] = gmt_format(topoInfo['y_max'])
+    meta['ALOOKS'] = gmt_format(topoInfo['x_inc']) #xinc
+    meta['RLOOKS'] = gmt_format(topoInfo['y_inc']) #yinc
+    meta['WIDTH'] = gmt_format(topoInfo['n_columns'])
+    meta['LENGTH'] = gmt_format(topoInfo['n_rows'])
+    # incidence and slantRange are only needed for geometry, time series export does not require them
+    if topopath.joinpath('incidence.grd').exists():
+        meta['INCIDENCE_ANGLE'] = float(grd_mean(topopath.joinpath('incidence.grd'))) #incMean
+    if topopath.joinpath('slantRange.grd').exists():
+        meta['SLANT_RANGE_DISTANCE'] = float(grd_mean(topopath.joinpath('slantRange.grd'))) #slantMean
+
+    try:
+        with open(cachefile, 'w') as f:
+            json.dump({'key': key, 'meta': meta}, f, indent=1, default=lambda x: x.item())
+    except (OSError, TypeError) as e:
+        print(f'Metadata cache could not be written: {cachefile}\nException: {e}')
+    return meta
+
+
+def get_metadata(topopath: Path, file_type: str) -> dict:
+    """
+    Metadata for SARvey/mintpy h5 files. file_type: 'geometry' or 'timeseries'
+    """
+    meta = dict(topo_metadata(topopath))
+    if file_type == 'geometry':
+        if 'INCIDENCE_ANGLE' not in meta or 'SLANT_RANGE_DISTANCE' not in meta:
+            raise Exception('incidence.grd or slantRange.grd seem not to exist in topo. Please check')
+        meta['starting_azimuth_line'] = meta['XMIN']
+        meta['FILE_TYPE'] = 'geometry'
+        meta['PROCESSOR'] = 'isce' # needed in case we use file for mintpy
+    elif file_type == 'timeseries':
+        meta.pop('INCIDENCE_ANGLE', None)
+        meta.pop('SLANT_RANGE_DISTANCE', None)
+        meta['FILE_TYPE'] = 'timeseries'
+        meta['UNIT'] = 'i'
+    else:
+        raise Exception(f'File type not supported: {file_type}')
+    meta['AZIMUTH_PIXEL_SIZE'] *= int(meta['ALOOKS'])
+    meta['RANGE_PIXEL_SIZE'] *= int(meta['RLOOKS'])
+    meta = readfile.standardize_metadata(meta)
+    return meta
@@ -0,0 +1,169 @@
+import numpy as np
+
+
+def candidate_pairs(days, bperp, mintbase, maxtbase, minpbase, maxpbase, valid_first=None):
+    """
+    Interferometric pairs (i, j) with days[i] < days[j] and
+    mintbase <= days[j] - days[i] < maxtbase, minpbase <= |bperp[j] - bperp[i]| < maxpbase.
+    Candidates come from a sweep over sorted days (searchsorted), so only pairs inside the temporal window are built.
+    valid_first: optional boolean mask of acquisitions allowed as first image of a pair.
+    Returns index arrays i, j into days
+    """
+    days = np.asarray(days, dtype=np.float64)
+    bperp = np.asarray(bperp, dtype=np.float64)
+    order = np.argsort(days, kind='stable')
+    t = days[order]
+
+    # For each acquisition, later acquisitions within [mintbase, maxtbase)
+    lo = np.searchsorted(t, t + mintbase, side='left') if mintbase > 0 else np.searchsorted(t, t, side='right')
+    hi = np.searchsorted(t, t + maxtbase, side='left')
+    counts = np.maximum(hi - lo, 0)
+    first = np.repeat(np.arange(len(t)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    second = np.repeat(lo, counts) + offsets
+    i, j = order[first], order[second]
+
+    dB = np.abs(bperp[j] - bperp[i])
+    keep = (dB >= minpbase) & (dB < maxpbase)
+    if valid_first is not None:
+        keep &= np.asarray(valid_first, dtype=bool)[i]
+    return i[keep], j[keep]
+
+
+def edge_weights(btemp, bperp, tau=None, bcrit=None):
+    """
+    Edge weights in [0, 1], higher is better.
+    With tau (days) and bcrit (m): expected coherence exp(-|Btemp|/tau) * max(0, 1 - |Bperp|/bcrit),
+    otherwise 1 - mean of |Btemp| and |Bperp| normalized by their maximum
+    """
+    if (tau is None) != (bcrit is None):
+        raise Exception(f'Coherence weights need both tau and bcrit, got tau: {tau} bcrit: {bcrit}')
+    btemp = np.abs(np.asarray(btemp, dtype=np.float64))
+    bperp = np.abs(np.asarray(bperp, dtype=np.float64))
+    if tau is not None:
+        if tau <= 0 or bcrit <= 0:
+            raise Exception(f'tau: {tau} and bcrit: {bcrit} must be positive')
+        return np.exp(-btemp / tau) * np.maximum(0.0, 1 - bperp / bcrit)
+    if btemp.size == 0:
+        return np.zeros(0)
+    return 1 - 0.5 * (btemp / max(btemp.max(), 1e-12) + bperp / max(bperp.max(), 1e-12))
+
+
+class _UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, x):
+        parent = self.parent
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(self, a, b) -> bool:
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return False
+        self.parent[rb] = ra
+        return True
+
+
+def optimize_network(days, cand_i, cand_j, weights, min_connections=2, max_pairs=None, nodes=None):
+    """
+    Selects a connected small baseline network from candidate pairs (cand_i, cand_j) with weights (higher is better):
+    1. maximum weight spanning forest of the candidates (Kruskal with union-find)
+    2. components left apart are bridged with pairs of consecutive dates, even outside the candidates
+    3. dates with less than min_connections pairs get their best remaining candidates, dates that still miss
+       the minimum (too few candidates) are paired with their nearest dates of other days, even outside the candidates
+    4. if max_pairs is given, extra pairs of step 3 with lowest weights are dropped; spanning and bridge pairs
+       (steps 1, 2 and pairs outside the candidates of step 3) are always kept, so the network stays connected
+    nodes: optional boolean mask of acquisitions that must be connected (default all).
+    Returns index arrays i, j (days[i] < days[j]) and number of pairs outside the candidates
+    """
+    days = np.asarray(days, dtype=np.float64)
+    n = len(days)
+    nodes = np.ones(n, dtype=bool) if nodes is None else np.asarray(nodes, dtype=bool)
+    cand_i, cand_j = np.asarray(cand_i, dtype=np.int64), np.asarray(cand_j, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    order = np.argsort(-weights, kind='stable')
+    cand_i, cand_j, weights = cand_i[order], cand_j[order], weights[order]
+
+    # 1. Maximum weight spanning forest
+    uf = _UnionFind(n)
+    chosen = np.zeros(len(cand_i), dtype=bool)
+    ntree = 0
+    for k, (a, b) in enumerate(zip(cand_i.tolist(), cand_j.tolist())):
+        if uf.union(a, b):
+            chosen[k] = True
+            ntree += 1
+            if ntree >= n - 1:
+                break
+
+    # 2. Bridges between consecutive dates of different components. Acquisitions of the same day are
+    #    bridged to the last acquisition of the previous day, so bridges always have days[a] < days[b]
+    bridges = list()
+    seq = np.flatnonzero(nodes)
+    seq = seq[np.argsort(days[seq], kind='stable')]
+    prev = last = None
+    for b in seq.tolist():
+        if last is not None and days[b] > days[last]:
+            prev = last
+        if prev is not None and uf.union(prev, b):
+            bridges.append((prev, b))
+        last = b
+
+    degree = np.zeros(n, dtype=np.int64)
+    np.add.at(degree, cand_i[chosen], 1)
+    np.add.at(degree, cand_j[chosen], 1)
+    for a, b in bridges:
+        degree[a] += 1
+        degree[b] += 1
+
+    # 3. Minimum connections per date, best candidates first
+    extra = np.zeros(len(cand_i), dtype=bool)
+    deficient = nodes & (degree < min_connections)
+    ndeficient = int(deficient.sum())
+    for k in np.flatnonzero(~chosen).tolist():
+        if not ndeficient:
+            break
+        a, b = int(cand_i[k]), int(cand_j[k])
+        if deficient[a] or deficient[b]:
+            extra[k] = True
+            for x in (a, b):
+                degree[x] += 1
+                if deficient[x] and degree[x] >= min_connections:
+                    deficient[x] = False
+                    ndeficient -= 1
+
+    # Dates without enough candidates: nearest dates in time, outside the candidates
+    if ndeficient:
+        linked = set(zip(cand_i[chosen | extra].tolist(), cand_j[chosen | extra].tolist())) | set(bridges)
+        for a in np.flatnonzero(deficient).tolist():
+            neighbours = sorted(seq.tolist(), key=lambda x: abs(days[x] - days[a]))
+            for b in neighbours:
+                if degree[a] >= min_connections:
+                    break
+                if days[b] == days[a]:
+                    continue
+                pair = (a, b) if days[a] < days[b] else (b, a)
+                if pair in linked:
+                    continue
+                linked.add(pair)
+                bridges.append(pair)
+                degree[a] += 1
+                degree[b] += 1
+
+    # 4. Cap on number of pairs, extra pairs are in descending weight order
+    nrequired = int(chosen.sum()) + len(bridges)
+    if max_pairs is not None:
+        if nrequired > max_pairs:
+            print(f'max_pairs: {max_pairs} is below pairs needed for a connected network: {nrequired}. Keeping {nrequired}')
+        keep = max(max_pairs - nrequired, 0)
+        extra[np.flatnonzero(extra)[keep:]] = False
+
+    sel = chosen | extra
+    bi = np.array([x[0] for x in bridges], dtype=np.int64)
+    bj = np.array([x[1] for x in bridges], dtype=np.int64)
+    return np.concatenate([cand_i[sel], bi]), np.concatenate([cand_j[sel], bj]), len(bridges)
@@ -0,0 +1,209 @@
+import os
+from pathlib import Path
+import numpy as np
+from netCDF4 import Dataset as NetCDFFile
+from .slc import open_slc, decode_slc
+from .grdinfo import _coord_names
+
+"""
+Multilooked overviews (2x, 4x, 8x... block means) of grids and SLCs for quicklooks.
+All levels are built in one streaming pass over the source and stored in a sidecar <source>.ovr.npz,
+keyed by mtime and size of the source (and PRM for SLCs). Levels larger than MAX_OVERVIEW_PIXELS are not stored,
+the coarsest level has at most MIN_OVERVIEW_SIZE pixels on its longest side.
+Grid levels hold the mean of finite values, SLC levels the complex mean and the power mean of the raw (unscaled) samples.
+"""
+
+OVERVIEW_SUFFIX = '.ovr.npz'
+MIN_OVERVIEW_SIZE = 256
+MAX_OVERVIEW_PIXELS = 2**24
+# Pixels read per block, rounded to whole rows of the coarsest level
+BLOCK_PIXELS = 2**22
+
+
+def overview_path(srcPath) -> Path:
+    return Path(str(srcPath) + OVERVIEW_SUFFIX)
+
+
+def _factors(shape) -> list:
+    factors, f = list(), 2
+    while True:
+        factors.append(f)
+        if max(shape) / f <= MIN_OVERVIEW_SIZE:
+            return factors
+        f *= 2
+
+
+def _key(paths):
+    key = list()
+    for path in paths:
+        st = os.stat(path)
+        key += [st.st_mtime_ns, st.st_size]
+    return np.array(key, dtype=np.int64)
+
+
+def _load(ovrPath: Path, key):
+    try:
+        with np.load(ovrPath) as ovr:
+            if np.array_equal(ovr['key'], key):
+                return {k: ovr[k] for k in ovr.files}
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def _save(ovrPath: Path, arrays: dict):
+    tmpPath = ovrPath.with_name(ovrPath.name + '.tmp.npz')
+    try:
+        np.savez(tmpPath, **arrays)
+        os.replace(tmpPath, ovrPath)
+    except OSError as e:
+        print(f'Overview could not be written: {ovrPath}\nException: {e}')
+
+
+def _reduce_levels(sums: list, count, factors, kept):
+    """
+    Successive 2x2 block sums of arrays in sums and of count, with rows and cols multiples of max(factors).
+    Yields (factor, block sums list, count) for factors in kept
+    """
+    for f in factors:
+        h, w = count.shape[0] // 2, count.shape[1] // 2
+        sums = [s.reshape(h, 2, w, 2).sum(axis=(1, 3)) for s in sums]
+        count = count.reshape(h, 2, w, 2).sum(axis=(1, 3))
+        if f in kept:
+            yield f, sums, count
+
+
+def _pad(a, rows, cols):
+    return np.pad(a, ((0, rows - a.shape[0]), (0, cols - a.shape[1])))
+
+
+def _build(shape, read_block, nsums, dtypes, names):
+    nrows, ncols = shape
+    factors = _factors(shape)
+    F = factors[-1]
+    kept = [f for f in factors if -(-nrows // f) * -(-ncols // f) <= MAX_OVERVIEW_PIXELS]
+    levels = {f'{name}{f}': np.empty((-(-nrows // f), -(-ncols // f)), dtype=dtype)
+              for f in kept for name, dtype in zip(names, dtypes)}
+    blockrows = max(F, BLOCK_PIXELS // ncols // F * F)
+    padcols = -(-ncols // F) * F
+    for r0 in range(0, nrows, blockrows):
+        r1 = min(r0 + blockrows, nrows)
+        padrows = -(-(r1 - r0) // F) * F
+        sums, count = read_block(r0, r1)
+        sums = [_pad(s, padrows, padcols) for s in sums]
+        count = _pad(count, padrows, padcols)
+        for f, fsums, fcount in _reduce_levels(sums, count, factors, kept):
+            a, b = r0 // f, -(-r1 // f)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                for name, s in zip(names, fsums[:nsums]):
+                    levels[f'{name}{f}'][a:b] = (s / fcount)[:b - a, :levels[f'{name}{f}'].shape[1]]
+    return np.array(kept, dtype=np.int64), levels
+
+
+def grd_overviews(grdPath) -> dict:
+    """
+    Overviews of grid: {'factors', 'extent', 'shape', 'z<f>' for each factor}. Built on first use or when the grid changed
+    """
+    grdPath = Path(grdPath)
+    key = _key([grdPath])
+    ovrPath = overview_path(grdPath)
+    ovr = _load(ovrPath, key)
+    if ovr is not None:
+        return ovr
+
+    with NetCDFFile(grdPath.as_posix()) as nc:
+        nc.set_auto_mask(False)
+        xname, yname = _coord_names(nc)
+        x, y = nc.variables[xname][:], nc.variables[yname][:]
+        extent = np.array([np.min(x), np.max(x), np.min(y), np.max(y)], dtype=np.float64)
+        z = nc.variables['z']
+
+        def read_block(r0, r1):
+            block = np.asarray(z[r0:r1], dtype=np.float32)
+            valid = np.isfinite(block)
+            return [np.where(valid, block, np.float32(0))], valid.astype(np.float32)
+
+        factors, levels = _build(z.shape, read_block, 1, [np.float32], ['z'])
+        shape = np.array(z.shape, dtype=np.int64)
+
+    ovr = {'key': key, 'factors': factors, 'extent': extent, 'shape': shape, **levels}
+    _save(ovrPath, ovr)
+    return ovr
+
+
+def slc_overviews(slcPath, prmPath) -> dict:
+    """
+    Overviews of SLC: {'factors', 'shape', 'c<f>' complex mean, 'p<f>' power mean for each factor} of raw samples.
+    Built on first use or when SLC or PRM changed
+    """
+    slcPath, prmPath = Path(slcPath), Path(prmPath)
+    key = _key([slcPath, prmPath])
+    ovrPath = overview_path(slcPath)
+    ovr = _load(ovrPath, key)
+    if ovr is not None:
+        return ovr
+
+    slc = open_slc(slcPath, prmPath)
+
+    def read_block(r0, r1):
+        raw = np.asarray(slc[r0:r1], dtype=np.float32)
+        re, im = raw[..., 0], raw[..., 1]
+        return [re, im, re * re + im * im], np.ones(re.shape, dtype=np.float32)
+
+    factors, levels = _build(slc.shape[:2], read_block, 3, [np.float32] * 3, ['re', 'im', 'p'])
+    ovr = {'key': key, 'factors': factors, 'shape': np.array(slc.shape[:2], dtype=np.int64)}
+    for f in factors:
+        c = np.empty(levels[f're{f}'].shape, dtype=np.complex64)
+        c.real, c.imag = levels.pop(f're{f}'), levels.pop(f'im{f}')
+        ovr[f'c{f}'] = c
+        ovr[f'p{f}'] = levels.pop(f'p{f}')
+    _save(ovrPath, ovr)
+    return ovr
+
+
+def pick_factor(shape, target, factors) -> int:
+    """
+    Coarsest factor whose level still has at least target (rows, cols) pixels, 1 (full resolution) if none
+    """
+    best = 1
+    for f in sorted(int(x) for x in factors):
+        if -(-shape[0] // f) >= target[0] and -(-shape[1] // f) >= target[1]:
+            best = f
+    return best
+
+
+def axes_pixels(ax) -> tuple:
+    """
+    (rows, cols) screen pixels of matplotlib axes
+    """
+    bbox = ax.get_window_extent()
+    return int(np.ceil(bbox.height)), int(np.ceil(bbox.width))
+
+
+def read_grd_overview(grdPath, target):
+    """
+    Grid z and extent at the coarsest overview level fitting target (rows, cols) pixels.
+    Returns z, extent [xmin, xmax, ymin, ymax] and factor, full grid is read when no level fits
+    """
+    ovr = grd_overviews(grdPath)
+    factor = pick_factor(ovr['shape'], target, ovr['factors'])
+    if factor == 1:
+        with NetCDFFile(Path(grdPath).as_posix()) as nc:
+            z = nc.variables['z'][:]
+    else:
+        z = ovr[f'z{factor}']
+    return z, list(ovr['extent']), factor
+
+
+def read_slc_overview(slcPath, prmPath, target, scale=2.5e-7, fixzeros=True):
+    """
+    SLC complex mean and power mean at the coarsest overview level fitting target (rows, cols) pixels.
+    Returns complex64, float32 arrays and factor. Full resolution is decoded when no level fits (scale and fixzeros
+    apply); overview levels are raw means, scaled by scale and scale**2
+    """
+    ovr = slc_overviews(slcPath, prmPath)
+    factor = pick_factor(ovr['shape'], target, ovr['factors'])
+    if factor == 1:
+        c = decode_slc(open_slc(slcPath, prmPath), scale=scale, fixzeros=fixzeros)
+        return c, (c.real ** 2 + c.imag ** 2), factor
+    return ovr[f'c{factor}'] * np.float32(scale), ovr[f'p{factor}'] * np.float32(scale ** 2), factor
@@ -0,0 +1,85 @@
+import os
+
+
+# Parsed PRM files: {absolute path: (mtime_ns, size, prm dict)}
+_prm_cache = dict()
+
+
+def _parse_value(value: str):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+class PRM(dict):
+    """
+    PRM dictionary of parsed values. raw keeps the original line of each key,
+    so write_prm writes unchanged values back verbatim (e.g. date = 050101)
+    """
+
+    def __init__(self, *args, raw=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.raw = dict(raw) if raw else dict()
+
+    def copy(self):
+        return PRM(self, raw=self.raw)
+
+
+def parse_prm(prmPath) -> PRM:
+    """
+    Parses a GMTSAR PRM file (key = value per line) into a dictionary.
+    Values are converted to int or float when possible, otherwise kept as strings
+    """
+    prm = PRM()
+    with open(prmPath, 'r') as f:
+        for line in f:
+            if '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            key = key.strip()
+            if key:
+                prm[key] = _parse_value(value.strip())
+                prm.raw[key] = line
+    return prm
+
+
+def read_prm(prmPath) -> dict:
+    """
+    Returns parsed PRM file. Files are parsed once and kept in a cache keyed by path and mtime,
+    so repeated lookups on the same PRM do not touch the file again unless it changed.
+    Each call returns a copy, changes made by a caller do not reach the cache
+    """
+    prmPath = os.path.abspath(prmPath)
+    st = os.stat(prmPath)
+    cached = _prm_cache.get(prmPath)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2].copy()
+
+    prm = parse_prm(prmPath)
+    _prm_cache[prmPath] = (st.st_mtime_ns, st.st_size, prm)
+    return prm.copy()
+
+
+def read_prms(prmPaths) -> list:
+    """
+    Bulk version of read_prm. Returns a list of PRM dictionaries in the same order as prmPaths
+    """
+    return [read_prm(prmPath) for prmPath in prmPaths]
+
+
+def write_prm(prm: dict, prmPath):
+    """
+    Writes PRM dictionary as key = value lines, keeping dictionary order.
+    Keys of a parsed PRM whose value did not change are written with their original line
+    """
+    raw = getattr(prm, 'raw', dict())
+    with open(prmPath, 'w') as f:
+        for key, value in prm.items():
+            line = raw.get(key)
+            if line is not None and _parse_value(line.split('=', 1)[1].strip()) == value:
+                f.write(line if line.endswith('\n') else line + '\n')
+            else:
+                f.write(f'{key} = {value}\n')
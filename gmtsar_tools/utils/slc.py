@@ -0,0 +1,65 @@
+import os
+import numpy as np
+from .prm import read_prm
+
+
+def slc_shape(prmPath):
+    """
+    Returns (num_lines, num_rng_bins) of SLC from PRM file
+    """
+    prm = read_prm(prmPath)
+    return int(prm['num_lines']), int(prm['num_rng_bins'])
+
+
+def open_slc(slcPath, prmPath):
+    """
+    Memory maps a GMTSAR SLC (interleaved int16 real, imag) as (num_lines, num_rng_bins, 2).
+    Nothing is read from disk until the array is sliced
+    """
+    nlines, rgbins = slc_shape(prmPath)
+    nbytes = os.path.getsize(slcPath)
+    if nbytes != nlines * rgbins * 4:
+        raise ValueError(f'SLC size: {nbytes} bytes does not match nrows {nlines} and range bins {rgbins} from PRM: {prmPath}')
+    return np.memmap(slcPath, dtype=np.int16, mode='r', shape=(nlines, rgbins, 2))
+
+
+def decode_slc(raw, scale=2.5e-7, fixzeros=True, out=None):
+    """
+    Converts int16 (..., 2) block into complex64. Pixels with zero real and imaginary parts get
+    real part 1 (as GMTSAR does) and values are multiplied by scale.
+    out: optional preallocated complex64 array with shape raw.shape[:-1]
+    """
+    if out is None:
+        out = np.empty(raw.shape[:-1], dtype=np.complex64)
+    out.real = raw[..., 0]
+    out.imag = raw[..., 1]
+    if fixzeros:
+        zmask = (raw[..., 0] == 0) & (raw[..., 1] == 0)
+        out.real[zmask] = 1
+    if scale != 1:
+        out *= np.float32(scale)
+    return out
+
+
+def read_slc(slcPath, prmPath, rows=None, cols=None, scale=2.5e-7, fixzeros=True):
+    """
+    Reads a window of SLC as complex64. rows and cols are (start, stop) tuples, None reads all
+    """
+    slc = open_slc(slcPath, prmPath)
+    r0, r1 = rows if rows else (0, slc.shape[0])
+    c0, c1 = cols if cols else (0, slc.shape[1])
+    return decode_slc(slc[r0:r1, c0:c1], scale=scale, fixzeros=fixzeros)
+
+
+def iter_slc_blocks(slcPath, prmPath, blockrows=1024, cols=None, scale=2.5e-7, fixzeros=True):
+    """
+    Yields (row start, row stop, complex64 block) over the SLC in blocks of blockrows lines.
+    The block buffer is reused, copy it if it has to outlive the iteration
+    """
+    slc = open_slc(slcPath, prmPath)
+    c0, c1 = cols if cols else (0, slc.shape[1])
+    buf = np.empty((blockrows, c1 - c0), dtype=np.complex64)
+    for r0 in range(0, slc.shape[0], blockrows):
+        r1 = min(r0 + blockrows, slc.shape[0])
+        block = decode_slc(slc[r0:r1, c0:c1], scale=scale, fixzeros=fixzeros, out=buf[:r1 - r0])
+        yield r0, r1, block
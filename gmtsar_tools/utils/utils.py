@@ -6,7 +6,9 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 import struct
-import geodezyx.conv as conv
+from .slc import read_slc
+from .prm import read_prm
+from .baseline import read_led, prm_time, WGS84_A, WGS84_B
 import pdb
 
 
@@ -39,9 +41,9 @@ def str2date(strdate: str) -> dt.date:
         return dt.date(int(strdate[:4]), int(strdate[4:6]), int(strdate[6:]))
     
 
-def try_command(cmd_list):
+def try_command(cmd_list, cwd=None):
     try:
-        r = subprocess.check_call(cmd_list)
+        r = subprocess.check_call(cmd_list, cwd=cwd)
     except subprocess.CalledProcessError as e:
         print(f'Command: {" ".join(cmd_list)} FAILED\nException: {e}')
         return False
@@ -53,9 +55,9 @@ def try_command(cmd_list):
             return True
 
 
-def run_command(cmd_list, check=False):
+def run_command(cmd_list, check=False, cwd=None):
         try:
-            r = subprocess.run(cmd_list, check=check)
+            r = subprocess.run(cmd_list, check=check, cwd=cwd)
         except subprocess.CalledProcessError as e:
             print(f'Command: {" ".join(cmd_list)} FAILED\nException: {e}')
             return False
@@ -88,34 +90,25 @@ def read_baseline_table(baselinetab: Path):
     dfsorted = data.sort_values(by='date_dt')
     return dfsorted
 
-def getSlcData(slcPath, prmPath, scale=2.5e-7):
+def getSlcData(slcPath, prmPath, scale=2.5e-7, rows=None, cols=None):
     """
-    Factor comes from GMTSAR processing
+    Factor comes from GMTSAR processing. Returns complex64 SLC, optionally only
+    the window given by rows and cols (start, stop) tuples
     """
-    #Get rows and columns
-    nlines = int(grep(prmPath, 'num_lines'))
-    rgbins = int(grep(prmPath, 'num_rng_bins'))
-    # read slc and reshape
-    slc_data = np.fromfile(slcPath, dtype=np.int16)
-    slc_data = slc_data.reshape(-1,2)
-    zmask = (slc_data[:, 0] == 0) & (slc_data[:, 1] == 0)
-    slc_data[zmask,0] = 1 # making real part 1
-    slc_data = slc_data.astype(np.float32)*scale
-    slc_data = slc_data[:,0] + 1j*slc_data[:,1]
-    #slc_data = slc_data.astype(np.float32).view(np.complex64)
     try:
-        slc_data = slc_data.reshape((nlines,rgbins))
+        slc_data = read_slc(slcPath, prmPath, rows=rows, cols=cols, scale=scale)
     except ValueError as e:
         print(f'Problem reshaping slc. PRM file: {prmPath}\nException: {e}')
         return -1
     else:
         return slc_data
                         
-def readOldGMTFormat(grd, offset=892):
+def readOldGMTFormat(grd, offset=892, mmap=False):
     """
     Function to read real.grd and imag.grd that have the old style native grid format with an offset of 892
     and format defined in:
     https://docs.generic-mapping-tools.org/6.2/cookbook/file-formats.html
+    If mmap is True data is returned as a read only np.memmap, so only the rows sliced are read
     """
     parms = ["n_columns", "n_rows", "registration", "x_min", "x_max", "y_min", "y_max", "z_min", "z_max", 
              "x_inc", "y_inc", "z_scale_factor", "z_add_offset", "x_units", "y_units", "z_units", "title", "command", "remark"]
@@ -139,52 +132,71 @@ def readOldGMTFormat(grd, offset=892):
             headerDict[parm] = headerDict[parm].decode('ascii').strip('\x00')
 
     # Getting and reshaping data
-    data = np.fromfile(grd, dtype=np.float32, offset=offset)
-    data = data.reshape((headerDict['n_rows'], headerDict['n_columns']))
+    if mmap:
+        data = np.memmap(grd, dtype=np.float32, mode='r', offset=offset,
+                         shape=(headerDict['n_rows'], headerDict['n_columns']))
+    else:
+        data = np.fromfile(grd, dtype=np.float32, offset=offset)
+        data = data.reshape((headerDict['n_rows'], headerDict['n_columns']))
 
     return data, headerDict
 
 
-def headingFromLED(ledfile):
-    with open(ledfile, 'r') as f:
-        lines = f.readlines()
-        lines = [x.strip() for x in lines]
+def ecef2geodetic(x, y, z):
+    """
+    Vectorized ECEF (m) to geodetic latitude, longitude (degrees) and height (m) on WGS84 (Bowring)
+    """
+    a, b = WGS84_A, WGS84_B
+    e2 = 1 - b**2 / a**2
+    ep2 = a**2 / b**2 - 1
+    p = np.hypot(x, y)
+    theta = np.arctan2(z * a, p * b)
+    lat = np.arctan2(z + ep2 * b * np.sin(theta)**3, p - e2 * a * np.cos(theta)**3)
+    lon = np.arctan2(y, x)
+    height = p / np.cos(lat) - a / np.sqrt(1 - e2 * np.sin(lat)**2)
+    return np.degrees(lat), np.degrees(lon), height
+
+
+def headingFromLED(ledfile, prmfile=None):
+    """
+    Mean bearing (degrees) between consecutive LED state vectors.
+    If prmfile is given only state vectors spanning that acquisition are used
+    """
     # Format for LED orbits: year, dayofYear, seconds, X, Y, Z, Vx, Vy, Vz
-    lines.pop(0) # removing header
-    count = 0
-    sumbearing = 0
-    for orb1, orb2 in zip(lines[:-1], lines[1:]):
-        _, _, _, x1,y1,z1, _, _, _ = orb1.split()
-        _, _, _, x2,y2,z2, _, _, _ = orb2.split()
-        lat1, lon1, _ = conv.XYZ2GEO(float(x1),float(y1),float(z1), outdeg=True)
-        lat2, lon2, _ = conv.XYZ2GEO(float(x2),float(y2),float(z2), outdeg=True)
-        sumbearing += calc_bearing(lat1, lon1, lat2, lon2)
-        count += 1
-    
-    mean_bearing = sumbearing/count
-    return mean_bearing
+    t, pos, _ = read_led(ledfile)
+    if prmfile is not None:
+        prm = read_prm(prmfile)
+        tstart = prm_time(prm['SC_clock_start'])
+        tstop = tstart + prm['num_lines'] / prm['PRF']
+        # keep the state vectors bracketing the acquisition
+        i0 = max(np.searchsorted(t, tstart, side='right') - 1, 0)
+        i1 = min(np.searchsorted(t, tstop, side='left') + 1, len(t))
+        if i1 - i0 >= 2:
+            t, pos = t[i0:i1], pos[i0:i1]
+    lat, lon, _ = ecef2geodetic(pos[:, 0], pos[:, 1], pos[:, 2])
+    bearings = calc_bearing(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    return float(np.mean(bearings))
+
+
+def headingsFromLEDs(ledfiles, prmfiles=None):
+    """
+    Heading of every LED in a stack, optionally per acquisition with matching prmfiles
+    """
+    prmfiles = prmfiles if prmfiles is not None else [None] * len(ledfiles)
+    return np.array([headingFromLED(led, prm) for led, prm in zip(ledfiles, prmfiles)])
 
 
 def calc_bearing(lat1, lon1, lat2, lon2):
-  import math
-  # Reference: https://mapscaping.com/how-to-calculate-bearing-between-two-coordinates/
-  # Convert latitude and longitude to radians
-  lat1 = math.radians(lat1)
-  lon1 = math.radians(lon1)
-  lat2 = math.radians(lat2)
-  lon2 = math.radians(lon2)
-  
-  # Calculate the bearing
-  bearing = math.atan2(
-      math.sin(lon2 - lon1) * math.cos(lat2),
-      math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(lon2 - lon1)
-  )
-  
-  # Convert the bearing to degrees
-  bearing = math.degrees(bearing)
-  
-  # Make sure the bearing is positive
-  bearing = (bearing + 360) % 360
-  
-  return bearing
-
+    # Reference: https://mapscaping.com/how-to-calculate-bearing-between-two-coordinates/
+    # Works on scalars and numpy arrays
+    # Convert latitude and longitude to radians
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+
+    # Calculate the bearing
+    bearing = np.arctan2(
+        np.sin(lon2 - lon1) * np.cos(lat2),
+        np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(lon2 - lon1)
+    )
+
+    # Convert the bearing to degrees and make sure it is positive
+    return (np.degrees(bearing) + 360) % 360
@@ -0,0 +1,93 @@
+import os
+import csv
+import json
+import glob
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .prm import read_prm
+
+REPORT_FIELDS = ['slc', 'prm', 'nlines', 'rgbins', 'expected_bytes', 'actual_bytes', 'zero_fraction', 'ok', 'message']
+SAMPLE_ROWS = 16
+
+
+def check_slc_file(slcPath, prmPath, sample=0) -> dict:
+    """
+    Checks SLC size against num_lines x num_rng_bins x 4 bytes from PRM, no data is read.
+    If sample > 0, that many blocks of rows spread over the file are read through a memmap and
+    the fraction of zero pixels is reported; a sample made only of zeros is flagged.
+    Returns a report dictionary with REPORT_FIELDS
+    """
+    report = {k: None for k in REPORT_FIELDS}
+    report.update({'slc': str(slcPath), 'prm': str(prmPath), 'ok': False})
+
+    if not os.path.exists(prmPath):
+        report['message'] = 'PRM file does not exist'
+        return report
+    prm = read_prm(prmPath)
+    nlines, rgbins = prm.get('num_lines'), prm.get('num_rng_bins')
+    if not nlines or not rgbins:
+        report['message'] = f'Error getting nlines: {nlines} or range bins: {rgbins} from PRM'
+        return report
+    nlines, rgbins = int(nlines), int(rgbins)
+    report.update({'nlines': nlines, 'rgbins': rgbins, 'expected_bytes': nlines * rgbins * 4})
+
+    try:
+        report['actual_bytes'] = os.path.getsize(slcPath)
+    except OSError as e:
+        report['message'] = f'SLC file can not be accessed: {e}'
+        return report
+
+    if report['actual_bytes'] != report['expected_bytes']:
+        report['message'] = f'SLC size: {report["actual_bytes"]} bytes does not match nrows {nlines} and range bins {rgbins}'
+        return report
+
+    if sample > 0:
+        try:
+            slc = np.memmap(slcPath, dtype=np.int16, mode='r', shape=(nlines, rgbins, 2))
+            starts = np.unique(np.linspace(0, max(nlines - SAMPLE_ROWS, 0), sample).astype(int))
+            zeros, total = 0, 0
+            for r0 in starts:
+                block = slc[r0:r0 + SAMPLE_ROWS]
+                zeros += np.count_nonzero((block[..., 0] == 0) & (block[..., 1] == 0))
+                total += block.shape[0] * block.shape[1]
+            del slc
+        except (OSError, ValueError) as e:
+            report['message'] = f'SLC sample could not be read: {e}'
+            return report
+        report['zero_fraction'] = zeros / total
+        if zeros == total:
+            report['message'] = 'Sampled blocks contain only zeros'
+            return report
+
+    report['ok'] = True
+    report['message'] = 'OK'
+    return report
+
+
+def check_slc_dir(directory, sample=0, workers=8) -> list:
+    """
+    Runs check_slc_file on every SLC in directory (PRM with same stem) with a thread pool.
+    Reports are returned sorted by SLC name
+    """
+    slcfiles = sorted(glob.glob(f'{Path(directory).as_posix()}/*.SLC'))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        reports = list(pool.map(lambda x: check_slc_file(x, Path(x).with_suffix('.PRM'), sample=sample), slcfiles))
+    return reports
+
+
+def write_report(reports: list, outfile):
+    """
+    Writes reports to JSON or CSV depending on outfile suffix
+    """
+    outfile = Path(outfile)
+    if outfile.suffix == '.json':
+        with open(outfile, 'w') as f:
+            json.dump(reports, f, indent=2)
+    elif outfile.suffix == '.csv':
+        with open(outfile, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(reports)
+    else:
+        raise Exception(f'Report format not supported: {outfile.suffix}. Use .json or .csv')
@@ -0,0 +1,21 @@
+from pathlib import Path
+from gmtsar_tools.utils import read_prm, write_prm
+from gmtsar_tools.utils.crop import crop_prm
+
+PRMFILE = Path(__file__).parent.joinpath('data', 'ENV1_2_076_2925_2943_18455.PRM')
+
+
+def test_write_prm_round_trip(tmp_path):
+    out = tmp_path.joinpath('out.PRM')
+    write_prm(read_prm(PRMFILE), out)
+    assert out.read_bytes() == PRMFILE.read_bytes()
+
+
+def test_crop_prm_keeps_unchanged_lines(tmp_path):
+    out = tmp_path.joinpath('crop.PRM')
+    write_prm(crop_prm(read_prm(PRMFILE), (100, 1100, 200, 1200), 'crop.SLC'), out)
+    lines = out.read_text().splitlines()
+    assert 'date\t\t\t= 050901' in lines
+    assert 'num_rng_bins = 1000' in lines
+    assert 'SLC_file = crop.SLC' in lines
+    assert read_prm(out)['num_lines'] == 1000